@@ -1,10 +1,11 @@
 import streamlit as st
 import preprocessor, helper
-import matplotlib.pyplot as plt
-import numpy as np
-import seaborn as sns
+import cache
+import charts
+import diagnostics
+import scheduler
+import pandas as pd
 import zipfile
-import io
 import os
 
 from helper import most_commonwords, montly_data, daily_data
@@ -116,16 +117,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Helper functions
-def decode_bytes(raw_bytes):
-    """Tries different encodings since Android and iPhone export chats differently"""
-    for encoding in ["utf-8", "utf-16", "latin-1"]:
-        try:
-            return raw_bytes.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    st.error("❌ Unable to decode chat file (unsupported encoding)")
-    st.stop()
-
 def get_image_path(filename):
     """Tries to find the image file, works with both relative and absolute paths"""
     relative_path = filename
@@ -133,6 +124,319 @@ def get_image_path(filename):
         return relative_path
     return filename
 
+@st.cache_resource
+def get_results_cache():
+    """One cache per server process, shared by every session and rerun"""
+    return cache.LRUCache()
+
+@st.cache_resource
+def get_chart_cache():
+    """Rendered charts as PNG bytes, kept apart so images can't push parsed chats out"""
+    return cache.LRUCache(cache.CHART_CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_analysis_executor():
+    """Worker threads the sections of an analysis are computed on, shared by every session"""
+    return scheduler.executor()
+
+@st.cache_resource
+def get_disk_cache():
+    """Parsed chats on disk, so they survive restarts"""
+    return cache.DiskCache()
+
+@st.cache_resource
+def get_export_log():
+    """Earlier .txt exports, to spot a re-export of the same chat with new messages"""
+    log = cache.ExportLog()
+    for key, signature in get_disk_cache().metadata():
+        log.add(key, signature)
+    return log
+
+# looked up here on the script thread, the threads computing sections have
+# no Streamlit context to find cached resources with
+results_cache = get_results_cache()
+chart_cache = get_chart_cache()
+
+def load_parsed(chat_hash):
+    """Parsed chat from memory or disk, or None"""
+    results = get_results_cache()
+    df = results.get((chat_hash, "preprocess"))
+    if df is None:
+        df = get_disk_cache().load(chat_hash)
+        if df is not None:
+            results.put((chat_hash, "preprocess"), df)
+    return df
+
+def parse_new_tail(raw_bytes):
+    """(df, encoding) parsing only what was added since an earlier export of the same chat, or None"""
+    earlier = get_export_log().find_prefix(raw_bytes)
+    if earlier is None:
+        return None
+    key, signature = earlier
+    old_df = load_parsed(key)
+    if old_df is None:
+        return None
+    try:
+        data = str(raw_bytes[signature["length"]:], signature["encoding"])
+    except UnicodeDecodeError:
+        return None
+    with diagnostics.stage("append", rows=len(data)) as record:
+        df = helper.append_messages(old_df, data)
+        record["rows"] = None if df is None else len(df) - len(old_df)
+    if df is None:
+        return None
+    return df, signature["encoding"]
+
+# choice in the user list that compares every participant in one table
+ALL_USERS = "All users"
+# helpers that look at the whole chat and take only df
+WHOLE_CHAT_HELPERS = ("most_busy_users", "leaderboard")
+
+def run_helper(chat_hash, name, selected_user, df):
+    """Runs helper.<name> once per (chat, user) and reuses it on later reruns"""
+    func = getattr(helper, name)
+    with diagnostics.stage("helper." + name, rows=len(df), user=selected_user, cached=True) as record:
+        def compute():
+            record["cached"] = False
+            if name in WHOLE_CHAT_HELPERS:
+                return func(df)
+            return func(selected_user, df)
+        return results_cache.get_or_compute((chat_hash, selected_user, name), compute)
+
+def parse(source):
+    """(df, encoding) of the export's bytes, decoded bit by bit as they are parsed
+
+    Android and iPhone export chats differently, the encoding is worked out
+    from a BOM or the first bytes.
+    """
+    with diagnostics.stage("preprocess") as record:
+        df, encoding = preprocessor.preprocess_bytes(source)
+        record["rows"] = len(df)
+    return df, encoding
+
+def chart_png(chat_hash, selected_user, name, data):
+    """PNG of charts.<name>(data), drawn once per (chat, user) and cached after that"""
+    def render():
+        with diagnostics.stage("render." + name):
+            return charts.render(getattr(charts, name)(data))
+    return chart_cache.get_or_compute((chat_hash, selected_user, name), render)
+
+SLOW_SECTIONS = ("wordcloud", "sentiment")
+# search results listed in the app, the count covers all of them
+SEARCH_RESULTS_SHOWN = 1000
+
+# Sections are computed on worker threads by the *_section functions below,
+# which only run helpers and draw PNGs, and shown by the draw_* functions on
+# the script thread, since Streamlit elements can only be added from there.
+# A section returns the arguments of its draw_* function.
+
+def overview_section(chat_hash, selected_user, df):
+    return run_helper(chat_hash, "fetch_stats", selected_user, df)
+
+def busy_users_section(chat_hash, selected_user, df):
+    x, new_df = run_helper(chat_hash, "most_busy_users", "Overall", df)
+    return chart_png(chat_hash, selected_user, "busy_users", x), new_df
+
+def leaderboard_section(chat_hash, selected_user, df):
+    return run_helper(chat_hash, "leaderboard", ALL_USERS, df),
+
+def chart_section(chat_hash, selected_user, df, name, chart, rows=None):
+    """helper.<name> (its first rows only, if given) and charts.<chart> of it"""
+    result = run_helper(chat_hash, name, selected_user, df)
+    if rows is not None:
+        result = result.head(rows)
+    return result, chart_png(chat_hash, selected_user, chart, result)
+
+def section(header):
+    """Header of a section and the placeholder it is drawn in once it's computed"""
+    st.markdown(f"""
+        <div class="section-header">{header}</div>
+    """, unsafe_allow_html=True)
+    return waiting()
+
+def waiting():
+    placeholder = st.empty()
+    placeholder.caption("⏳ Working on it...")
+    return placeholder
+
+def draw_overview(num_messages, words, num_media_messages, num_links):
+    cards = [
+        ("💬 Total Messages", num_messages),
+        ("📝 Total Words", words),
+        ("🖼️ Media Shared", num_media_messages),
+        ("🔗 Links Shared", num_links)
+    ]
+    for col, (label, value) in zip(st.columns(4), cards):
+        with col:
+            st.markdown(f"""
+                <div class="stat-card">
+                    <div class="stat-label">{label}</div>
+                    <div class="stat-value">{value:,}</div>
+                </div>
+            """, unsafe_allow_html=True)
+    st.markdown("<br>", unsafe_allow_html=True)
+
+def draw_busy_users(png, new_df):
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.image(png, use_container_width=True)
+    with col2:
+        st.markdown("### 📈 User Contribution")
+        st.dataframe(
+            new_df,
+            use_container_width=True,
+            hide_index=True
+        )
+
+def draw_leaderboard(board):
+    st.caption("Click a column header to sort. Sentiment columns are the percent of a user's text messages.")
+    st.dataframe(
+        board,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "percent": st.column_config.NumberColumn("% of messages", format="%.2f%%"),
+            "top_emoji": "top emoji",
+            "Positive": st.column_config.NumberColumn(format="%.1f%%"),
+            "Neutral": st.column_config.NumberColumn(format="%.1f%%"),
+            "Negative": st.column_config.NumberColumn(format="%.1f%%"),
+            "busiest_hour": "busiest hour"
+        }
+    )
+
+def draw_sentiment(sentiments, png):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Positive", sentiments["Positive"])
+    with col2:
+        st.metric("Neutral", sentiments["Neutral"])
+    with col3:
+        st.metric("Negative", sentiments["Negative"])
+    # pie chart for sentiment analysis
+    st.image(png, use_container_width=True)
+
+def draw_wordcloud(df_wc, png):
+    st.image(png, use_container_width=True)
+
+def draw_common_words(most_common_df, png):
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.image(png, use_container_width=True)
+    with col2:
+        st.markdown("### 📊 Word Frequency Table")
+        st.dataframe(
+            most_common_df,
+            use_container_width=True,
+            hide_index=True
+        )
+
+def draw_emojis(top_emojis, png):
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.markdown("### 📋 Emoji Frequency")
+        st.dataframe(
+            top_emojis,
+            use_container_width=True,
+            hide_index=True
+        )
+    with col2:
+        st.image(png, use_container_width=True)
+
+def draw_monthly(monthly_df, png):
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.markdown("### 📊 Monthly Data")
+        st.dataframe(
+            monthly_df,
+            use_container_width=True,
+            hide_index=True
+        )
+    with col2:
+        st.image(png, use_container_width=True)
+
+def draw_daily(daily_data_df, png):
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.markdown("### 📊 Daily Data")
+        # Only showing last 10 days to keep it readable
+        st.dataframe(
+            daily_data_df.tail(10),
+            use_container_width=True,
+            hide_index=True
+        )
+    with col2:
+        st.image(png, use_container_width=True)
+
+def draw_activity(activity, png):
+    st.dataframe(
+        activity.reset_index(),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.image(png, use_container_width=True)
+
+def draw_heatmap(heat_map, png):
+    st.image(png, use_container_width=True)
+
+def show_search(selected_user, df):
+    """Keyword search over the chat, for the selected user and a range of days"""
+    # no messages parsed, there are no days to pick between either
+    if not len(df):
+        return
+    with st.expander("🔎 Search messages", expanded=bool(st.session_state.get("search_query"))):
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            query = st.text_input(
+                "Words to find",
+                key="search_query",
+                placeholder="movie tonight OR cricket",
+                help="Messages with all of the words; put OR between words to find either"
+            )
+        with col2:
+            first, last = df['date'].min().date(), df['date'].max().date()
+            days = st.date_input("Between", (first, last), min_value=first, max_value=last)
+        if not query.strip():
+            return
+
+        # the second day is missing while the range is being picked
+        start, end = (days[0], days[-1]) if days else (None, None)
+        user = "Overall" if selected_user == ALL_USERS else selected_user
+        with diagnostics.stage("search", user=user) as record:
+            found = helper.search_messages(user, df, query, start, end)
+            record["rows"] = len(found)
+        st.caption(f"{len(found):,} messages match, found in {record['seconds'] * 1000:.0f} ms")
+        if not len(found):
+            return
+
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            shown = found.head(SEARCH_RESULTS_SHOWN)
+            if len(found) > len(shown):
+                st.caption(f"Showing the first {len(shown):,}")
+            st.dataframe(
+                shown.assign(message=shown['message'].str.rstrip('\n')),
+                use_container_width=True,
+                hide_index=True
+            )
+        with col2:
+            per_user = found['user'].value_counts()
+            st.dataframe(
+                per_user[per_user > 0].rename("matches").reset_index(),
+                use_container_width=True,
+                hide_index=True
+            )
+
+def show_diagnostics(stages):
+    st.markdown("""
+        <div class="section-header">🩺 Diagnostics</div>
+    """, unsafe_allow_html=True)
+    if not stages:
+        st.caption("Nothing was computed on this run, everything came from the cache.")
+        return
+    table = pd.DataFrame(stages, columns=["stage", "parent", "seconds", "rows", "memory_delta_mb", "cached", "user"])
+    st.caption(f"{table.loc[table['parent'].isna(), 'seconds'].sum():.2f}s in {len(table)} stages on this run")
+    st.dataframe(table, use_container_width=True, hide_index=True)
+
 # CHANGED: File uploader moved from sidebar to main page for mobile-first UX
 # Main page content starts here
 st.markdown("### 📤 Upload WhatsApp Chat")
@@ -191,32 +495,51 @@ if uploaded_file is None:
 
 # Process the uploaded file
 if uploaded_file is not None:
-    with st.spinner("🔄 Processing your chat file..."):
-        # Handle zip files (iPhone exports sometimes come as zip)
-        if uploaded_file.name.endswith(".zip"):
-            with zipfile.ZipFile(io.BytesIO(uploaded_file.getvalue())) as z:
-                txt_file = None
-                for name in z.namelist():
-                    if name.endswith(".txt"):
-                        txt_file = name
-                        break
-
-                if txt_file is None:
-                    st.error("❌ No WhatsApp chat .txt file found inside ZIP")
-                    st.stop()
-
-                raw_bytes = z.read(txt_file)
-                data = decode_bytes(raw_bytes)
-
-        # Regular txt file (most common)
-        else:
-            raw_bytes = uploaded_file.getvalue()
-            data = decode_bytes(raw_bytes)
-
-        # Clean up the data
-        df = preprocessor.preprocess(data)
-        
-        st.success(f"✅ Successfully loaded {len(df)} messages!")
+    stages = diagnostics.start_trace()
+
+    # Same upload as an earlier rerun (or another session) -> skip decoding and parsing
+    chat_hash = cache.content_hash(uploaded_file.getbuffer())
+    results = get_results_cache()
+    df = load_parsed(chat_hash)
+
+    if df is None:
+        with st.spinner("🔄 Processing your chat file..."):
+            # Handle zip files (iPhone exports sometimes come as zip)
+            if uploaded_file.name.endswith(".zip"):
+                # the upload is already a seekable file, and the chat is
+                # streamed out of the archive rather than read whole
+                uploaded_file.seek(0)
+                with zipfile.ZipFile(uploaded_file) as z:
+                    txt_file = None
+                    for name in z.namelist():
+                        if name.endswith(".txt"):
+                            txt_file = name
+                            break
+
+                    if txt_file is None:
+                        st.error("❌ No WhatsApp chat .txt file found inside ZIP")
+                        st.stop()
+
+                    with z.open(txt_file) as member:
+                        df, encoding = parse(member)
+                meta = None
+
+            # Regular txt file (most common)
+            else:
+                raw_bytes = uploaded_file.getbuffer()
+                # a longer export of a chat seen before only needs its new messages parsed
+                appended = parse_new_tail(raw_bytes)
+                if appended is None:
+                    df, encoding = parse(raw_bytes)
+                else:
+                    df, encoding = appended
+                meta = cache.export_signature(raw_bytes, encoding)
+                get_export_log().add(chat_hash, meta)
+
+            results.put((chat_hash, "preprocess"), df)
+            get_disk_cache().save(chat_hash, df, meta)
+
+    st.success(f"✅ Successfully loaded {len(df)} messages!")
 
     # Get list of users for the dropdown
     user_list = df['user'].unique().tolist()
@@ -224,6 +547,7 @@ if uploaded_file is not None:
         user_list.remove('group_notification')
     user_list.sort()
     user_list.insert(0, "Overall")
+    user_list.insert(1, ALL_USERS)
 
     # CHANGED: User selection and button moved from sidebar to main page
     st.markdown("---")
@@ -231,7 +555,7 @@ if uploaded_file is not None:
     selected_user = st.selectbox(
         "Analyze for:",
         user_list,
-        help="Select a user to analyze their individual stats, or 'Overall' for group analysis"
+        help="Select a user to analyze their individual stats, 'Overall' for group analysis, or 'All users' to compare everyone"
     )
     
     analyze_button = st.button(
@@ -240,314 +564,99 @@ if uploaded_file is not None:
         use_container_width=True,
         help="Click to generate comprehensive chat analysis"
     )
+    diagnostics_on = st.checkbox(
+        "Show diagnostics",
+        help="Time, rows and memory of every step on this run, to see where a slow chat spends it"
+    )
 
-    # Show the analysis when button is clicked
-    if analyze_button:
-        # Get basic stats
-        num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user, df)
-
-        # Display stats in cards
-        st.markdown("""
-            <div class="section-header">📊 Overview Statistics</div>
-        """, unsafe_allow_html=True)
-        
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-label">💬 Total Messages</div>
-                    <div class="stat-value">{num_messages:,}</div>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-label">📝 Total Words</div>
-                    <div class="stat-value">{words:,}</div>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        with col3:
-            st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-label">🖼️ Media Shared</div>
-                    <div class="stat-value">{num_media_messages:,}</div>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        with col4:
-            st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-label">🔗 Links Shared</div>
-                    <div class="stat-value">{num_links:,}</div>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-
-        # Show most active users only when analyzing overall group stats
-        if selected_user == "Overall":
-            st.markdown("""
-                <div class="section-header">👥 Most Active Users</div>
-            """, unsafe_allow_html=True)
-            
-            x, new_df = helper.most_busy_users(df)
-            
-            col1, col2 = st.columns([1, 1])
-            
-            with col1:
-                fig, ax = plt.subplots(figsize=(10, 6))
-                colors = plt.cm.viridis(np.linspace(0, 1, len(x)))
-                bars = ax.bar(x.index, x.values, color=colors)
-                ax.set_xlabel('Users', fontsize=12, fontweight='bold')
-                ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
-                ax.set_title('Messages by User', fontsize=14, fontweight='bold', pad=20)
-                plt.xticks(rotation=45, ha='right')
-                plt.tight_layout()
-                st.pyplot(fig)
-            
-            with col2:
-                st.markdown("### 📈 User Contribution")
-                st.dataframe(
-                    new_df,
-                    use_container_width=True,
-                    hide_index=True
-                )
-#sentiment analysis
-        st.title("😊 Sentiment Analysis")
-
-        sentiments = helper.sentiment_analysis(selected_user, df)
-
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            st.metric("Positive", sentiments["Positive"])
-        with col2:
-            st.metric("Neutral", sentiments["Neutral"])
-        with col3:
-            st.metric("Negative", sentiments["Negative"])
-
-
-#pie chart for sentiment analysis
-        fig, ax = plt.subplots()
-        ax.pie(
-            sentiments.values(),
-            labels=sentiments.keys(),
-            autopct="%1.1f%%",
-            startangle=90
-        )
-        st.pyplot(fig)
-
-
+    show_search(selected_user, df)
 
-        # Word cloud visualization
-        st.markdown("""
-            <div class="section-header">☁️ Word Cloud</div>
-        """, unsafe_allow_html=True)
-        
-        df_wc = helper.create_wordcloud(selected_user, df)
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.imshow(df_wc, interpolation='bilinear')
-        ax.axis('off')
-        plt.tight_layout()
-        st.pyplot(fig)
-
-        # Most common words
-        st.markdown("""
-            <div class="section-header">📚 Most Used Words</div>
-        """, unsafe_allow_html=True)
-        
-        most_common_df = helper.most_commonwords(selected_user, df)
-        
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            fig, ax = plt.subplots(figsize=(10, 8))
-            colors = plt.cm.plasma(np.linspace(0, 1, len(most_common_df)))
-            bars = ax.barh(most_common_df[0], most_common_df[1], color=colors)
-            ax.set_xlabel('Frequency', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Words', fontsize=12, fontweight='bold')
-            ax.set_title('Top 20 Most Common Words', fontsize=14, fontweight='bold', pad=20)
-            plt.tight_layout()
-            st.pyplot(fig)
-        
-        with col2:
-            st.markdown("### 📊 Word Frequency Table")
-            st.dataframe(
-                most_common_df,
-                use_container_width=True,
-                hide_index=True
-            )
-
-        # Emoji analysis
-        st.markdown("""
-            <div class="section-header">😊 Most Used Emojis</div>
-        """, unsafe_allow_html=True)
-        
-        emoji_func = helper.commonly_used_emojis(selected_user, df)
-        
-        col1, col2 = st.columns([1, 1])
-        
-        with col1:
-            st.markdown("### 📋 Emoji Frequency")
-            st.dataframe(
-                emoji_func.head(10),
-                use_container_width=True,
-                hide_index=True
-            )
-        
-        with col2:
-            fig, ax = plt.subplots(figsize=(8, 8))
-            top_emojis = emoji_func.head(10)
-            colors = plt.cm.Set3(np.linspace(0, 1, len(top_emojis)))
-            ax.pie(
-                top_emojis[1],
-                labels=top_emojis[0],
-                autopct="%1.1f%%",
-                colors=colors,
-                startangle=90
-            )
-            ax.set_title('Top 10 Emojis Distribution', fontsize=14, fontweight='bold', pad=20)
-            plt.tight_layout()
-            st.pyplot(fig)
+    if analyze_button:
+        st.session_state["analyzed"] = (chat_hash, selected_user)
+
+    # Show the analysis when button is clicked, and keep it up while searching
+    if st.session_state.get("analyzed") == (chat_hash, selected_user):
+        # None of the sections depend on each other, so they are all computed
+        # at once and each is drawn as soon as it's ready: the overview cards
+        # show up right away while sentiment and the word cloud still run
+        analysis = scheduler.Analysis(get_analysis_executor())
+        sections = {}
+
+        def add_section(name, placeholder, draw, func, *args):
+            sections[name] = (placeholder, draw, func, args)
+
+        with diagnostics.stage("analysis", user=selected_user):
+            if selected_user == ALL_USERS:
+                add_section("leaderboard", section("🏆 All Users"), draw_leaderboard, leaderboard_section)
+            else:
+                add_section("overview", section("📊 Overview Statistics"), draw_overview, overview_section)
+
+                # Show most active users only when analyzing overall group stats
+                if selected_user == "Overall":
+                    add_section("busy_users", section("👥 Most Active Users"), draw_busy_users, busy_users_section)
+
+                st.title("😊 Sentiment Analysis")
+                add_section("sentiment", waiting(), draw_sentiment,
+                            chart_section, "sentiment_analysis", "sentiment")
+
+                add_section("wordcloud", section("☁️ Word Cloud"), draw_wordcloud,
+                            chart_section, "create_wordcloud", "wordcloud")
+
+                add_section("common_words", section("📚 Most Used Words"), draw_common_words,
+                            chart_section, "most_commonwords", "common_words")
+
+                add_section("emojis", section("😊 Most Used Emojis"), draw_emojis,
+                            chart_section, "commonly_used_emojis", "emojis", 10)
+
+                add_section("monthly", section("📅 Monthly Timeline"), draw_monthly,
+                            chart_section, "montly_data", "monthly_timeline")
+
+                add_section("daily", section("📆 Daily Timeline"), draw_daily,
+                            chart_section, "daily_data", "daily_timeline")
+
+                # Activity patterns
+                st.markdown("""
+                    <div class="section-header">🗓️ Activity Map</div>
+                """, unsafe_allow_html=True)
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown("### 📊 Most Active Days")
+                    add_section("week_activity", waiting(), draw_activity,
+                                chart_section, "week_activity", "week_activity")
+                with col2:
+                    st.markdown("### 📊 Most Active Months")
+                    add_section("month_activity", waiting(), draw_activity,
+                                chart_section, "month_activity", "month_activity")
+
+                add_section("heatmap", section("⏰ Hourly Activity Heatmap"), draw_heatmap,
+                            chart_section, "hourly_activity", "heatmap")
+
+            # sentiment and the word cloud take longest, so they are queued last
+            # and never hold up the quick sections when threads are short
+            for name in sorted(sections, key=lambda name: name in SLOW_SECTIONS):
+                func, args = sections[name][2:]
+                analysis.submit(name, func, chat_hash, selected_user, df, *args)
+
+            for name, future in analysis.completed():
+                placeholder, draw = sections[name][:2]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # one broken section shouldn't take the rest of the page with it
+                    placeholder.error(f"❌ Couldn't compute this section: {e}")
+                    continue
+                with placeholder.container():
+                    draw(*result)
 
-        # Monthly timeline
-        st.markdown("""
-            <div class="section-header">📅 Monthly Timeline</div>
-        """, unsafe_allow_html=True)
-        
-        monthly_Func = helper.montly_data(selected_user, df)
-        
-        col1, col2 = st.columns([1, 1])
-        
-        with col1:
-            st.markdown("### 📊 Monthly Data")
-            st.dataframe(
-                monthly_Func,
-                use_container_width=True,
-                hide_index=True
-            )
-        
-        with col2:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.plot(monthly_Func['time'], monthly_Func['message'], 
-                   marker='o', linewidth=2, markersize=8, color='#667eea')
-            ax.fill_between(monthly_Func['time'], monthly_Func['message'], alpha=0.3, color='#667eea')
-            ax.set_xlabel('Month-Year', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
-            ax.set_title('Messages Over Time', fontsize=14, fontweight='bold', pad=20)
-            plt.xticks(rotation=45, ha='right')
-            plt.grid(True, alpha=0.3)
-            plt.tight_layout()
-            st.pyplot(fig)
-
-        # Daily timeline
-        st.markdown("""
-            <div class="section-header">📆 Daily Timeline</div>
-        """, unsafe_allow_html=True)
-        
-        daily_data_df = helper.daily_data(selected_user, df)
-        
-        col1, col2 = st.columns([1, 1])
-        
-        with col1:
-            st.markdown("### 📊 Daily Data")
-            # Only showing last 10 days to keep it readable
-            st.dataframe(
-                daily_data_df.tail(10),
-                use_container_width=True,
-                hide_index=True
-            )
-        
-        with col2:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.plot(daily_data_df['day-date'], daily_data_df['message'], 
-                   marker='o', linewidth=2, markersize=4, color='#764ba2', alpha=0.7)
-            ax.fill_between(range(len(daily_data_df)), daily_data_df['message'], 
-                           alpha=0.3, color='#764ba2')
-            ax.set_xlabel('Day', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
-            ax.set_title('Daily Message Activity', fontsize=14, fontweight='bold', pad=20)
-            plt.xticks(rotation=45, ha='right')
-            plt.grid(True, alpha=0.3)
-            plt.tight_layout()
-            st.pyplot(fig)
-
-        # Activity patterns
-        st.markdown("""
-            <div class="section-header">🗓️ Activity Map</div>
-        """, unsafe_allow_html=True)
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("### 📊 Most Active Days")
-            active_day = helper.week_activity(selected_user, df)
-            
-            st.dataframe(
-                active_day.reset_index(),
-                use_container_width=True,
-                hide_index=True
-            )
-            
-            fig, ax = plt.subplots(figsize=(8, 6))
-            colors = plt.cm.coolwarm(np.linspace(0, 1, len(active_day)))
-            bars = ax.bar(active_day.index, active_day.values, color=colors)
-            ax.set_xlabel('Day of Week', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
-            ax.set_title('Weekly Activity Pattern', fontsize=14, fontweight='bold', pad=20)
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            st.pyplot(fig)
-        
-        with col2:
-            st.markdown("### 📊 Most Active Months")
-            active_months = helper.month_activity(selected_user, df)
-            
-            st.dataframe(
-                active_months.reset_index(),
-                use_container_width=True,
-                hide_index=True
-            )
-            
-            fig, ax = plt.subplots(figsize=(8, 6))
-            colors = plt.cm.spring(np.linspace(0, 1, len(active_months)))
-            bars = ax.bar(active_months.index, active_months.values, color=colors)
-            ax.set_xlabel('Month', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
-            ax.set_title('Monthly Activity Pattern', fontsize=14, fontweight='bold', pad=20)
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            st.pyplot(fig)
-
-        # Hourly heatmap
-        st.markdown("""
-            <div class="section-header">⏰ Hourly Activity Heatmap</div>
-        """, unsafe_allow_html=True)
-        
-        heat_map = helper.hourly_activity(selected_user, df)
-        
-        fig, ax = plt.subplots(figsize=(14, 8))
-        sns.heatmap(
-            heat_map,
-            annot=True,
-            fmt='.0f',
-            cmap='YlOrRd',
-            cbar_kws={'label': 'Message Count'},
-            linewidths=0.5,
-            linecolor='gray'
-        )
-        ax.set_xlabel('Hour Period', fontsize=12, fontweight='bold')
-        ax.set_ylabel('Day of Week', fontsize=12, fontweight='bold')
-        ax.set_title('Hourly Activity Heatmap', fontsize=14, fontweight='bold', pad=20)
-        plt.tight_layout()
-        st.pyplot(fig)
-        
         st.markdown("---")
         st.markdown("""
             <div style='text-align: center; padding: 2rem; color: var(--text-color-secondary);'>
                 <p>✨ Analysis complete! Explore the insights above.</p>
             </div>
         """, unsafe_allow_html=True)
+
+        # the chat's index grew while the sections ran, count it against the cache budget
+        results_cache.put((chat_hash, "preprocess"), df)
+
+    if diagnostics_on:
+        show_diagnostics(stages)
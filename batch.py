@@ -0,0 +1,213 @@
+"""Analyze many WhatsApp exports without the UI
+
+    python batch.py exports/ -o results/ --workers 8
+    python batch.py "exports/**/*.zip" -o results/ --format parquet --per-user
+    python batch.py exports/ -o results/ --store chats.db
+
+Writes one <chat>.json (or a <chat>/ folder of .parquet tables) per export
+with everything the dashboard shows, and reports messages per second.
+With --store every parsed chat is also added to a SQLite store (see store.py)
+for questions across all of them.
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import chat_index
+import helper
+import preprocessor
+import store
+
+EXTENSIONS = ('.txt', '.zip')
+FORMATS = ['json', 'parquet']
+
+
+def find_exports(sources):
+    """(path, output name) of every export under the given directories and globs"""
+    found = []
+    for source in sources:
+        if os.path.isdir(source):
+            root = source
+            paths = [os.path.join(folder, name)
+                     for folder, _, names in os.walk(source) for name in names]
+        else:
+            paths = glob.glob(source, recursive=True)
+            root = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ''
+        for path in sorted(paths):
+            if os.path.isfile(path) and path.lower().endswith(EXTENSIONS):
+                # nested folders can hold chats with the same file name
+                name = os.path.splitext(os.path.relpath(path, root or '.'))[0]
+                found.append((path, name.replace(os.sep, '__')))
+    return _unique_names(found)
+
+
+def _unique_names(found):
+    # a.txt next to a.zip would both write a.json, so those keep their
+    # extension, and anything still taken gets a number
+    counts = collections.Counter(name for _, name in found)
+    seen_paths = set()
+    used = set()
+    unique = []
+    for path, name in found:
+        if path in seen_paths:
+            continue
+        seen_paths.add(path)
+        if counts[name] > 1:
+            name += os.path.splitext(path)[1]
+        base, n = name, 2
+        while name in used:
+            name = '%s-%d' % (base, n)
+            n += 1
+        used.add(name)
+        unique.append((path, name))
+    return unique
+
+
+def parse_export(path):
+    """Parsed chat of a .txt export or the first .txt inside a .zip one, read from disk as it is parsed"""
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as z:
+            members = [name for name in z.namelist() if name.endswith('.txt')]
+            if not members:
+                raise ValueError('no WhatsApp chat .txt file inside ' + path)
+            with z.open(members[0]) as member:
+                return preprocessor.preprocess_bytes(member)[0]
+    # memory-mapped, so a multi-GB export is never read onto the heap
+    return preprocessor.preprocess_file(path)[0]
+
+
+def _sections(selected_user, df):
+    # the same helper calls the dashboard makes, as flat tables
+    messages, words, media, links = helper.fetch_stats(selected_user, df)
+    heatmap = helper.hourly_activity(selected_user, df)
+    sentiment = helper.sentiment_analysis(selected_user, df)
+    return {
+        'stats': pd.DataFrame({'messages': [messages], 'words': [words],
+                               'media': [media], 'links': [links]}),
+        'monthly_timeline': helper.montly_data(selected_user, df),
+        'daily_timeline': helper.daily_data(selected_user, df),
+        'week_activity': helper.week_activity(selected_user, df).reset_index(),
+        'month_activity': helper.month_activity(selected_user, df).reset_index(),
+        'hourly_activity': heatmap.stack().rename('message').reset_index(),
+        'common_words': helper.most_commonwords(selected_user, df).set_axis(['word', 'count'], axis=1),
+        'emojis': helper.commonly_used_emojis(selected_user, df).set_axis(['emoji', 'count'], axis=1),
+        'sentiment': pd.DataFrame({'sentiment': list(sentiment), 'count': list(sentiment.values())}),
+    }
+
+
+def analyze(df, per_user=False):
+    """Everything the dashboard shows for a parsed chat, as DataFrames keyed by section
+
+    Each table has a 'user' column: 'Overall', plus every user with
+    per_user.
+    """
+    users = ['Overall']
+    if per_user:
+        users += [user for user in df['user'].cat.categories if user != chat_index.NOTIFICATION_USER]
+
+    tables = {}
+    for user in users:
+        for name, table in _sections(user, df).items():
+            tables.setdefault(name, []).append(table.assign(user=user))
+    tables = {name: pd.concat(parts, ignore_index=True) for name, parts in tables.items()}
+
+    busy = helper.most_busy_users(df)[1]
+    tables['busy_users'] = busy.rename(columns={'name': 'user'})
+    tables['leaderboard'] = helper.leaderboard(df).rename(columns={'name': 'user'})
+    return tables
+
+
+def write_results(tables, out_dir, name, fmt):
+    if fmt == 'parquet':
+        folder = os.path.join(out_dir, name)
+        os.makedirs(folder, exist_ok=True)
+        for section, table in tables.items():
+            # object columns of datetime.date / str are handled by pyarrow
+            table.to_parquet(os.path.join(folder, section + '.parquet'), index=False)
+        return
+
+    result = {section: json.loads(table.to_json(orient='records', date_format='iso'))
+              for section, table in tables.items()}
+    with open(os.path.join(out_dir, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def _init_worker(parse_workers=1):
+    # the pool already uses every core, a second pool per chat would only fight it
+    chat_index.SENTIMENT_WORKERS = 1
+    # except for cores left over when there are fewer chats than workers
+    preprocessor.PARSE_WORKERS = parse_workers
+
+
+def process_export(path, name, out_dir, fmt, per_user, store_path=None):
+    """Parses and analyzes one export, returns (number of messages, seconds taken)"""
+    start = time.perf_counter()
+    df = parse_export(path)
+    write_results(analyze(df, per_user), out_dir, name, fmt)
+    if store_path:
+        # after analyze, so the word and link counts are already there to reuse
+        with store.Store(store_path) as db:
+            db.add_chat(name, df, name=path)
+    return len(df), time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze WhatsApp chat exports without the UI')
+    parser.add_argument('sources', nargs='+', help='directories or glob patterns of .txt/.zip exports')
+    parser.add_argument('-o', '--output', default='results', help='output directory (default: results)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='json')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--per-user', action='store_true', help='also analyze every user on their own')
+    parser.add_argument('--store', metavar='DATABASE',
+                        help='also add every chat to this SQLite store, replacing earlier runs of the same chat')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('--format parquet needs pyarrow installed')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    exports = find_exports(args.sources)
+    if not exports:
+        parser.error('no .txt or .zip exports found')
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    total_messages = 0
+    failed = 0
+    parse_workers = max(1, args.workers // len(exports))
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(exports)), initializer=_init_worker,
+                             initargs=(parse_workers,)) as pool:
+        futures = {pool.submit(process_export, path, name, args.output, args.format, args.per_user, args.store): path
+                   for path, name in exports}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                messages, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print('FAILED %s: %s' % (path, e), file=sys.stderr)
+                continue
+            total_messages += messages
+            print('%s: %d messages in %.2fs' % (path, messages, seconds))
+
+    elapsed = time.perf_counter() - start
+    print('%d chats, %d messages in %.2fs (%.0f messages/sec), %d failed' % (
+        len(exports) - failed, total_messages, elapsed, total_messages / elapsed if elapsed else 0, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Synthetic WhatsApp exports for benchmarking
+
+    python benchmarks/generate.py 100000 -o chat_100k.txt
+
+Writes an Android style export (dd/mm/yyyy, HH:MM - user: message) with
+multi-line messages, media placeholders, links, emoji sequences, Hinglish
+text and group notifications, streamed to disk so 10M messages don't have
+to fit in memory. The same seed always gives the same chat.
+"""
+import argparse
+import datetime
+import random
+import sys
+
+DATE_FORMAT = '%d/%m/%Y, %H:%M'
+
+USERS = ['Asha', 'Rohit Kumar', 'Priya', '+91 98765 43210', 'Dev', 'Neha Sharma', 'Arjun',
+         '+91 91234 56789', 'Kavya', 'Sameer Khan', 'Ananya', 'Vikram', 'Meera', 'Karan']
+# a few people do most of the talking in any group
+USER_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(USERS))]
+
+HINGLISH = ['hai', 'haan', 'nahi', 'acha', 'accha', 'kya', 'kal', 'aaj', 'chalo', 'yaar', 'bhai', 'scene',
+            'mast', 'bas', 'theek', 'matlab', 'abhi', 'kaha', 'ho', 'gaya', 'kar', 'raha', 'tha', 'mein',
+            'bhi', 'toh', 'ek', 'baar', 'pakka', 'sahi', 'bolo', 'dekho', 'arre', 'kuch', 'sab', 'log']
+ENGLISH = ['the', 'movie', 'party', 'love', 'hate', 'great', 'bad', 'ok', 'lol', 'good', 'awesome',
+           'terrible', 'tonight', 'tomorrow', 'office', 'meeting', 'traffic', 'dinner', 'cricket',
+           'match', 'exam', 'happy', 'birthday', 'thanks', 'sorry', 'call', 'me', 'when', 'free', 'done']
+EMOJIS = ['😂', '🤣', '❤️', '👍', '👍🏽', '🙏', '🔥', '😊', '😭', '🥳', '🇮🇳', '👨‍👩‍👧', '🤦‍♂️', '💯', '😅']
+LINKS = ['https://youtu.be/%s', 'https://www.instagram.com/p/%s/', 'www.example.com/%s',
+         'http://maps.google.com/?q=%s', 'https://docs.google.com/document/d/%s/edit']
+SHORT_REPLIES = ['ok', 'Ok', 'haan', 'hmm', 'lol', 'acha', 'done', 'yes', 'no', '👍', '😂😂😂']
+ENCRYPTION_NOTICE = ('Messages and calls are end-to-end encrypted. '
+                     'No one outside of this chat, not even WhatsApp, can read or listen to them.')
+
+
+def _words(rng, n):
+    return ' '.join(rng.choice(HINGLISH) if rng.random() < 0.6 else rng.choice(ENGLISH) for _ in range(n))
+
+
+def _message(rng):
+    r = rng.random()
+    if r < 0.06:
+        return '<Media omitted>'
+    if r < 0.16:
+        return rng.choice(SHORT_REPLIES)
+    if r < 0.20:
+        link = rng.choice(LINKS) % '%x' % rng.getrandbits(40)
+        return _words(rng, rng.randint(0, 6)) + ' ' + link
+    text = _words(rng, rng.randint(1, 18))
+    if rng.random() < 0.3:
+        text += ' ' + rng.choice(EMOJIS) * rng.randint(1, 3)
+    if rng.random() < 0.05:
+        # later lines of a multi-line message have no header, some even look like "user: text"
+        for _ in range(rng.randint(1, 3)):
+            text += '\n' + _words(rng, rng.randint(1, 8))
+        if rng.random() < 0.3:
+            text += '\nnote: ' + _words(rng, 3)
+    return text
+
+
+def _notification(rng, user):
+    r = rng.random()
+    if r < 0.4:
+        return '%s added %s' % (user, rng.choice(USERS))
+    if r < 0.6:
+        return '%s left' % user
+    if r < 0.8:
+        return '%s changed the subject to "%s"' % (user, _words(rng, 2))
+    return "%s changed this group's icon" % user
+
+
+def generate(out, messages, seed=1, start=datetime.datetime(2019, 1, 1, 9, 0)):
+    """Writes an export with the given number of messages to the text stream out"""
+    rng = random.Random(seed)
+    when = start
+    # every export opens with this notification, it isn't counted in messages
+    batch = ['%s - %s\n' % (when.strftime(DATE_FORMAT), ENCRYPTION_NOTICE)]
+    for _ in range(messages):
+        # chats are bursty: mostly quick replies, sometimes hours of silence
+        when += datetime.timedelta(minutes=rng.choice((0, 0, 1, 1, 2, 5, 30, rng.randint(60, 900))))
+        user = rng.choices(USERS, USER_WEIGHTS)[0]
+        if rng.random() < 0.01:
+            batch.append('%s - %s\n' % (when.strftime(DATE_FORMAT), _notification(rng, user)))
+        else:
+            batch.append('%s - %s: %s\n' % (when.strftime(DATE_FORMAT), user, _message(rng)))
+        if len(batch) >= 10000:
+            out.write(''.join(batch))
+            batch = []
+    out.write(''.join(batch))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic WhatsApp chat export')
+    parser.add_argument('messages', type=int, help='number of messages, e.g. 10000 to 10000000')
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.output is None:
+        generate(sys.stdout, args.messages, args.seed)
+        return
+    with open(args.output, 'w', encoding='utf-8') as f:
+        generate(f, args.messages, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Times every stage of the analysis on synthetic chats and compares with a baseline
+
+    python benchmarks/run.py                          # 10k and 100k messages
+    python benchmarks/run.py --sizes 1000000 10000000 --repeat 1
+    python benchmarks/run.py --save-baseline          # after an intended change
+
+Each size is generated once (see generate.py) and kept in --data-dir. For
+every stage (decoding, parsing, then each helper for 'Overall' and for the
+busiest user) the best wall time over --repeat fresh runs is recorded,
+plus the peak Python/numpy memory from one extra run under tracemalloc.
+Sentiment scoring done in worker processes isn't seen by tracemalloc.
+
+Stages more than --tolerance slower (or bigger) than baseline.json are
+reported as regressions and make the exit code 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import helper  # noqa: E402
+import preprocessor  # noqa: E402
+from generate import generate  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_SIZES = [10000, 100000]
+
+# the helpers app.py calls, in the order it calls them
+HELPERS = ['fetch_stats', 'most_busy_users', 'create_wordcloud', 'most_commonwords', 'commonly_used_emojis',
+           'montly_data', 'daily_data', 'week_activity', 'month_activity', 'hourly_activity',
+           'sentiment_analysis']
+
+# differences smaller than this are noise whatever the ratio
+MIN_SECONDS = 0.01
+MIN_MB = 1.0
+
+
+def chat_file(data_dir, messages, seed=1):
+    path = os.path.join(data_dir, 'chat_%d_%d.txt' % (messages, seed))
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            generate(f, messages, seed)
+        os.replace(tmp, path)
+    return path
+
+
+def _stages(path):
+    """(name, function) pairs run in order, later ones use what earlier ones return"""
+    state = {}
+
+    def decode():
+        with open(path, 'rb') as f:
+            state['data'] = preprocessor.decode(f.read())[0]
+
+    def preprocess():
+        state['df'] = preprocessor.preprocess(state['data'])
+        # most messages come from the first users, like a real group
+        users = state['df']['user'].value_counts()
+        state['user'] = users.index[0] if users.index[0] != 'group_notification' else users.index[1]
+
+    stages = [('decode', decode), ('preprocess', preprocess)]
+    for name in HELPERS:
+        func = getattr(helper, name)
+        if name == 'most_busy_users':
+            stages.append((name, lambda func=func: func(state['df'])))
+            continue
+        stages.append((name, lambda func=func: func('Overall', state['df'])))
+        # a second user is what switching users in the app costs
+        stages.append((name + ' (user)', lambda func=func: func(state['user'], state['df'])))
+    return stages
+
+
+def time_stages(path, repeat):
+    best = {}
+    for _ in range(repeat):
+        for name, stage in _stages(path):
+            start = time.perf_counter()
+            stage()
+            seconds = time.perf_counter() - start
+            best[name] = min(seconds, best.get(name, seconds))
+    return best
+
+
+def measure_memory(path):
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for name, stage in _stages(path):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            stage()
+            peaks[name] = (tracemalloc.get_traced_memory()[1] - before) / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run(sizes, data_dir, repeat, memory=True):
+    # stop words, URL list, emoji pattern and VADER lexicon load once per process
+    helper.warm_up()
+    results = {}
+    for messages in sizes:
+        path = chat_file(data_dir, messages)
+        seconds = time_stages(path, repeat)
+        peaks = measure_memory(path) if memory else {}
+        results[str(messages)] = {
+            name: {'seconds': round(seconds[name], 6), 'peak_mb': round(peaks[name], 3) if memory else None}
+            for name in seconds
+        }
+    return results
+
+
+def _cells(value, reference, fmt):
+    """(value, baseline, ratio) columns of the report and the ratio itself"""
+    if value is None:
+        return ['-', '-', '-'], None
+    if reference is None:
+        return [fmt % value, '-', '-'], None
+    ratio = value / reference if reference else (float('inf') if value else 1.0)
+    return [fmt % value, fmt % reference, '%.2f' % ratio], ratio
+
+
+def compare(results, baseline, tolerance):
+    """Lines of the report and the number of regressions"""
+    row = '%-30s %10s %10s %7s %10s %10s %7s%s'
+    lines = []
+    regressions = 0
+    for size, stages in results.items():
+        lines += ['', format(int(size), ',') + ' messages',
+                  row % ('stage', 'seconds', 'baseline', 'ratio', 'peak MB', 'baseline', 'ratio', '')]
+        for name, now in stages.items():
+            old = baseline.get(size, {}).get(name, {})
+            cells = []
+            flagged = False
+            for key, fmt, minimum in (('seconds', '%.4f', MIN_SECONDS), ('peak_mb', '%.1f', MIN_MB)):
+                column, ratio = _cells(now[key], old.get(key), fmt)
+                cells += column
+                if ratio is not None and ratio > 1 + tolerance and now[key] - old[key] > minimum:
+                    flagged = True
+            regressions += flagged
+            lines.append(row % tuple([name] + cells + ['  REGRESSION' if flagged else '']))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark parsing and every helper on synthetic chats')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='messages per chat')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per size, the best one counts')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'wp-chat-bench'),
+                        help='where generated chats are kept between runs')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower or bigger than baseline is allowed (default 0.25 = 25%%)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.data_dir, args.repeat, memory=not args.no_memory)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+    lines, regressions = compare(results, baseline, args.tolerance)
+    print('\n'.join(lines))
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        # keep sizes this run didn't cover
+        baseline.update(results)
+        report['results'] = baseline
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print('\nbaseline saved to ' + args.baseline)
+        return 0
+
+    if regressions:
+        print('\n%d stage(s) regressed by more than %d%%' % (regressions, args.tolerance * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import chat_index
+
+try:
+    import pyarrow as pa
+except ImportError:  # the on-disk cache is simply off without pyarrow
+    pa = None
+
+# total size the in-memory cache may hold, shared by every session
+DEFAULT_MAX_BYTES = int(os.environ.get('CHAT_CACHE_MB', '512')) * 1024 * 1024
+
+# rendered chart images, separate from the rest so they can't evict parsed chats
+CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MB', '128')) * 1024 * 1024
+
+# parsed chats kept on disk between uploads and restarts
+DISK_CACHE_DIR = os.environ.get(
+    'CHAT_DISK_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'wp-chat-analyzer'))
+DISK_CACHE_MAX_BYTES = int(os.environ.get('CHAT_DISK_CACHE_MB', '2048')) * 1024 * 1024
+PARSER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessor.py')
+
+# exports are told apart by a hash of their first bytes before hashing a whole prefix
+HEAD_BYTES = 1 << 16
+
+_MISSING = object()
+
+
+def content_hash(raw):
+    """SHA-256 of the uploaded bytes (bytes or a memoryview)"""
+    return hashlib.sha256(raw).hexdigest()
+
+
+def parser_version():
+    """Short hash of the parser source, so any change to it invalidates the disk cache"""
+    with open(PARSER_SOURCE, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def sizeof(value):
+    """Rough number of bytes held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        # a parsed chat's index is often bigger than the chat itself
+        return int(value.memory_usage(index=True, deep=True).sum()) + chat_index.nbytes(value)
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread safe least recently used cache bounded by the size of its values"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = sizeof(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            # something bigger than the whole budget would only flush everything else
+            if size > self.max_bytes:
+                return value
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= evicted
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, compute())
+        return value
+
+
+def export_signature(raw, encoding):
+    """What ExportLog needs to know about one .txt export"""
+    return {
+        'length': len(raw),
+        'head': hashlib.sha256(raw[:HEAD_BYTES]).hexdigest(),
+        'encoding': encoding
+    }
+
+
+class ExportLog:
+    """Exports seen before, to notice when an upload is one of them plus new lines"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, signature):
+        with self._lock:
+            self._entries[key] = signature
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def find_prefix(self, raw):
+        """(key, signature) of the longest earlier export raw starts with, or None"""
+        with self._lock:
+            entries = sorted(self._entries.items(), key=lambda e: e[1]['length'], reverse=True)
+        head = hashlib.sha256(raw[:HEAD_BYTES]).hexdigest()
+        for key, signature in entries:
+            length = signature['length']
+            if length >= len(raw):
+                continue
+            # a prefix shorter than HEAD_BYTES has to be hashed on its own
+            if length >= HEAD_BYTES:
+                if signature['head'] != head:
+                    continue
+            elif signature['head'] != hashlib.sha256(raw[:length]).hexdigest():
+                continue
+            if content_hash(raw[:length]) == key:
+                return key, signature
+        return None
+
+
+class DiskCache:
+    """Parsed chats as Arrow IPC files, one per (content hash, parser version)
+
+    Files are read back through a memory map. The message text, most of
+    the file, stays there as an Arrow-backed string column; the dates,
+    numbers and category codes are copied onto the heap. Every hit
+    bumps the file's mtime and the oldest files are dropped once the
+    directory grows past max_bytes. Files written by another parser
+    version can never be hit again and are removed on startup.
+    """
+
+    def __init__(self, directory=DISK_CACHE_DIR, max_bytes=DISK_CACHE_MAX_BYTES, version=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version or parser_version()
+        self.enabled = pa is not None
+        if self.enabled:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._drop_stale()
+            except OSError:
+                self.enabled = False
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '-' + self.version + '.arrow')
+
+    def _files(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.arrow'):
+                yield entry
+
+    def _drop_stale(self):
+        suffix = '-' + self.version + '.arrow'
+        for entry in self._files():
+            if not entry.name.endswith(suffix):
+                _remove(entry.path)
+
+    def metadata(self):
+        """(key, meta) for every cached chat saved with meta"""
+        if not self.enabled:
+            return
+        suffix = '-' + self.version + '.arrow'
+        for entry in self._files():
+            try:
+                meta = pa.ipc.open_file(pa.memory_map(entry.path, 'r')).schema.metadata or {}
+            except (OSError, pa.ArrowInvalid):
+                continue
+            if b'chat_meta' in meta:
+                yield entry.name[:-len(suffix)], json.loads(meta[b'chat_meta'])
+
+    def load(self, key):
+        """The cached DataFrame for key, or None"""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            os.utime(path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        return table.to_pandas()
+
+    def save(self, key, df, meta=None):
+        if not self.enabled:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if meta is not None:
+            table = table.replace_schema_metadata(
+                dict(table.schema.metadata or {}, chat_meta=json.dumps(meta)))
+        path = self.path(key)
+        # write under a temp name so a half written file is never loaded
+        tmp = '%s.tmp%d-%d' % (path, os.getpid(), threading.get_ident())
+        with pa.OSFile(tmp, 'wb') as f:
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in files)
+        for entry in files:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            _remove(entry.path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,207 @@
+import io
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+
+# what st.pyplot uses, so cached images look the same as before
+SAVEFIG_OPTIONS = {'format': 'png', 'bbox_inches': 'tight', 'dpi': 200}
+
+# timelines plot at most this many points, picked by lttb(); the tables keep every row
+MAX_TIMELINE_POINTS = 400
+# more month labels than this on the x axis can't be read anyway
+MAX_XTICKS = 24
+# markers only help while the points are far enough apart to see them
+MAX_MARKER_POINTS = 100
+
+# Figures are made with Figure() rather than plt.subplots(), so pyplot never
+# keeps a reference to them and they go away as soon as they are rendered.
+
+
+def render(fig):
+    """PNG bytes of a figure, which is cleared straight after"""
+    buf = io.BytesIO()
+    fig.savefig(buf, **SAVEFIG_OPTIONS)
+    fig.clear()
+    return buf.getvalue()
+
+
+def lttb(x, y, n_out):
+    """Indexes of n_out points picked by Largest-Triangle-Three-Buckets
+
+    The points in between the first and last are split into n_out - 2
+    buckets and from each the one making the biggest triangle with the
+    previous pick and the next bucket's average is kept, so peaks and dips
+    survive where plain resampling would average them away.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def _rotate_xticks(ax):
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
+
+def busy_users(x):
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    colors = plt.cm.viridis(np.linspace(0, 1, len(x)))
+    ax.bar(x.index, x.values, color=colors)
+    ax.set_xlabel('Users', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
+    ax.set_title('Messages by User', fontsize=14, fontweight='bold', pad=20)
+    _rotate_xticks(ax)
+    fig.tight_layout()
+    return fig
+
+
+def sentiment(sentiments):
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(
+        sentiments.values(),
+        labels=sentiments.keys(),
+        autopct="%1.1f%%",
+        startangle=90
+    )
+    return fig
+
+
+def wordcloud(df_wc):
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    ax.imshow(df_wc, interpolation='bilinear')
+    ax.axis('off')
+    fig.tight_layout()
+    return fig
+
+
+def common_words(most_common_df):
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    colors = plt.cm.plasma(np.linspace(0, 1, len(most_common_df)))
+    ax.barh(most_common_df[0], most_common_df[1], color=colors)
+    ax.set_xlabel('Frequency', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Words', fontsize=12, fontweight='bold')
+    ax.set_title('Top 20 Most Common Words', fontsize=14, fontweight='bold', pad=20)
+    fig.tight_layout()
+    return fig
+
+
+def emojis(top_emojis):
+    fig = Figure(figsize=(8, 8))
+    ax = fig.subplots()
+    colors = plt.cm.Set3(np.linspace(0, 1, len(top_emojis)))
+    ax.pie(
+        top_emojis[1],
+        labels=top_emojis[0],
+        autopct="%1.1f%%",
+        colors=colors,
+        startangle=90
+    )
+    ax.set_title('Top 10 Emojis Distribution', fontsize=14, fontweight='bold', pad=20)
+    fig.tight_layout()
+    return fig
+
+
+def monthly_timeline(timeline):
+    timeline = timeline.iloc[lttb(np.arange(len(timeline)), timeline['message'], MAX_TIMELINE_POINTS)]
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(timeline['time'], timeline['message'],
+            marker='o', linewidth=2, markersize=8, color='#667eea')
+    ax.fill_between(timeline['time'], timeline['message'], alpha=0.3, color='#667eea')
+    ax.set_xlabel('Month-Year', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
+    ax.set_title('Messages Over Time', fontsize=14, fontweight='bold', pad=20)
+    ax.xaxis.set_major_locator(MaxNLocator(MAX_XTICKS, integer=True))
+    _rotate_xticks(ax)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    return fig
+
+
+def daily_timeline(daily_data_df):
+    days = pd.to_datetime(daily_data_df['day-date'])
+    keep = lttb(days.values.astype(np.int64), daily_data_df['message'], MAX_TIMELINE_POINTS)
+    days, messages = days.iloc[keep], daily_data_df['message'].iloc[keep]
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(days, messages,
+            marker='o' if len(days) <= MAX_MARKER_POINTS else None, linewidth=2, markersize=4, color='#764ba2', alpha=0.7)
+    ax.fill_between(days, messages,
+                    alpha=0.3, color='#764ba2')
+    ax.set_xlabel('Day', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
+    ax.set_title('Daily Message Activity', fontsize=14, fontweight='bold', pad=20)
+    _rotate_xticks(ax)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    return fig
+
+
+def week_activity(active_day):
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    colors = plt.cm.coolwarm(np.linspace(0, 1, len(active_day)))
+    ax.bar(active_day.index, active_day.values, color=colors)
+    ax.set_xlabel('Day of Week', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
+    ax.set_title('Weekly Activity Pattern', fontsize=14, fontweight='bold', pad=20)
+    _rotate_xticks(ax)
+    fig.tight_layout()
+    return fig
+
+
+def month_activity(active_months):
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    colors = plt.cm.spring(np.linspace(0, 1, len(active_months)))
+    ax.bar(active_months.index, active_months.values, color=colors)
+    ax.set_xlabel('Month', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Message Count', fontsize=12, fontweight='bold')
+    ax.set_title('Monthly Activity Pattern', fontsize=14, fontweight='bold', pad=20)
+    _rotate_xticks(ax)
+    fig.tight_layout()
+    return fig
+
+
+def heatmap(heat_map):
+    fig = Figure(figsize=(14, 8))
+    ax = fig.subplots()
+    sns.heatmap(
+        heat_map,
+        annot=True,
+        fmt='.0f',
+        cmap='YlOrRd',
+        cbar_kws={'label': 'Message Count'},
+        linewidths=0.5,
+        linecolor='gray',
+        ax=ax
+    )
+    ax.set_xlabel('Hour Period', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Day of Week', fontsize=12, fontweight='bold')
+    ax.set_title('Hourly Activity Heatmap', fontsize=14, fontweight='bold', pad=20)
+    fig.tight_layout()
+    return fig
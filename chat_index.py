@@ -0,0 +1,883 @@
+import copy
+import multiprocessing
+import os
+import re
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import emoji
+import numpy as np
+import pandas as pd
+
+import diagnostics
+from preprocessor import DAY_NAMES, MONTH_NAMES, PERIODS
+
+MEDIA_MESSAGE = '<Media omitted>\n'
+NOTIFICATION_USER = 'group_notification'
+# every TLD URLExtract knows starts with a dot, plus bare 'localhost'; messages
+# without either can't contain a link, so only the rest go through URLExtract
+LINK_HINT = re.compile(r'\.\w|localhost', re.IGNORECASE)
+SENTIMENT_LABELS = ['Positive', 'Negative', 'Neutral']
+# what search looks words up by: 'movie!!' and 'movie,' are both the term movie
+SEARCH_TERM = re.compile(r'\w+')
+# below this many distinct texts starting worker processes costs more than it saves
+PARALLEL_SENTIMENT_TEXTS = 20000
+# processes used for sentiment scoring, None for one per CPU
+SENTIMENT_WORKERS = None
+# scoring is started from the app's analysis threads, and a process forked
+# while other threads hold locks can hang on them
+SENTIMENT_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STOP_WORDS_FILE = os.path.join(BASE_DIR, 'stop_hinglish.txt')
+# nltk data shipped next to the app is searched before the usual nltk
+# locations; the lexicon is never downloaded at runtime
+LOCAL_NLTK_DATA = os.path.join(BASE_DIR, 'nltk_data')
+VADER_LEXICON = 'sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt'
+
+# one ChatIndex per parsed DataFrame, dropped together with the frame
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def stop_words():
+    """Hinglish + english stop words as a set, read once per process"""
+    with open(STOP_WORDS_FILE, 'r', encoding='utf-8') as f:
+        return frozenset(f.read().split())
+
+
+# nltk and urlextract are slow to import, so they are only pulled in on first use
+
+@lru_cache(maxsize=None)
+def url_extractor():
+    """URLExtract over the TLD list bundled with the package (no network)"""
+    from urlextract import URLExtract
+    return URLExtract()
+
+
+@lru_cache(maxsize=None)
+def sentiment_analyzer():
+    """VADER loaded from ./nltk_data or any nltk data dir ($NLTK_DATA included)"""
+    import nltk
+    from nltk.sentiment import SentimentIntensityAnalyzer
+
+    if LOCAL_NLTK_DATA not in nltk.data.path:
+        nltk.data.path.insert(0, LOCAL_NLTK_DATA)
+    try:
+        nltk.data.find(VADER_LEXICON)
+    except LookupError:
+        raise LookupError(
+            "VADER lexicon not found. Run 'python -m nltk.downloader -d nltk_data vader_lexicon' "
+            "once where there is network access, or point NLTK_DATA at a copy of it"
+        ) from None
+    return SentimentIntensityAnalyzer(lexicon_file=VADER_LEXICON)
+
+
+def _compound_scores(texts):
+    polarity_scores = sentiment_analyzer().polarity_scores
+    return [polarity_scores(text)['compound'] for text in texts]
+
+
+def score_texts(texts, workers=None):
+    """VADER compound score of each text, spread over a process pool for long lists"""
+    if workers is None:
+        workers = SENTIMENT_WORKERS or os.cpu_count() or 1
+    if workers <= 1 or len(texts) < PARALLEL_SENTIMENT_TEXTS:
+        with diagnostics.stage('vader', rows=len(texts), workers=1):
+            return np.asarray(_compound_scores(texts), dtype=np.float64)
+
+    size = -(-len(texts) // (workers * 4))
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    with diagnostics.stage('vader', rows=len(texts), workers=workers):
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context(SENTIMENT_START_METHOD)) as pool:
+            scores = [score for part in pool.map(_compound_scores, chunks) for score in part]
+    return np.asarray(scores, dtype=np.float64)
+
+
+def count_links(messages):
+    """Number of URLs in each message"""
+    counts = np.zeros(len(messages), dtype=np.int32)
+    find_urls = url_extractor().find_urls
+    search = LINK_HINT.search
+    # shared links get forwarded around, so each distinct text is extracted once
+    seen = {}
+    with diagnostics.stage('urls', rows=len(messages)):
+        for i, message in enumerate(messages):
+            if search(message):
+                n = seen.get(message)
+                if n is None:
+                    n = seen[message] = len(find_urls(message))
+                counts[i] = n
+    return counts
+
+
+def _char_ranges(chars, gap=1):
+    # merges code points into a compact regex character class body; a gap
+    # above 1 also swallows the unused code points between nearby ranges
+    ranges = []
+    for cp in sorted(ord(c) for c in chars):
+        if ranges and cp <= ranges[-1][1] + gap:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return ''.join(re.escape(chr(lo)) if lo == hi else re.escape(chr(lo)) + '-' + re.escape(chr(hi))
+                   for lo, hi in ranges)
+
+
+def _trie_pattern(node):
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # greedy optional tail, so the longest sequence wins
+    return '(?:' + body + ')?' if '' in node else body
+
+
+@lru_cache(maxsize=None)
+def emoji_pattern():
+    """One regex matching every emoji the emoji package knows, longest first
+
+    The alternation is laid out as a trie, so skin tones, ZWJ families and
+    flags come out as one match instead of their separate code points. The
+    lookahead rejects ordinary characters before any branch is tried.
+    """
+    trie = {}
+    for e in emoji.EMOJI_DATA:
+        node = trie
+        for ch in e:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    wide = {e[0] for e in emoji.EMOJI_DATA if not e[0].isascii()}
+    # keycaps start with a plain '#', '*' or digit
+    narrow = {e[0] for e in emoji.EMOJI_DATA if e[0].isascii()}
+    narrow_next = {e[1] for e in emoji.EMOJI_DATA if e[0].isascii()}
+    start = '(?=[' + _char_ranges(wide, gap=256) + ']|[' + _char_ranges(narrow) + '][' + _char_ranges(narrow_next) + '])'
+    return re.compile(start + _trie_pattern(trie))
+
+
+def _users(df):
+    # user code of every row, and the names in order of first message
+    codes, users = pd.factorize(np.asarray(df['user'], dtype=object), sort=False)
+    return codes, pd.Index(users, dtype=object)
+
+
+def _add_users(users, names):
+    # codes of names in users, with names not seen before added at the end
+    names = np.asarray(names, dtype=object)
+    new = pd.Index(pd.unique(names), dtype=object).difference(users, sort=False)
+    if len(new):
+        users = users.append(new)
+    return users.get_indexer(names), users
+
+
+def _content(df):
+    # rows that are actual text: no group notifications, no media placeholders
+    return (np.asarray(df['user'], dtype=object) != NOTIFICATION_USER) & (df['message'].values != MEDIA_MESSAGE)
+
+
+def _by_user(user_codes, n_users):
+    # stable order that groups items by user, and where each user's run starts
+    order = np.argsort(user_codes, kind='stable')
+    bounds = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(user_codes, minlength=n_users), out=bounds[1:])
+    return order, bounds
+
+
+def _append_by_user(bounds, new_codes, n_users):
+    # like _by_user for (items already grouped by bounds) + new items, which
+    # land at the end of their user's run
+    old_codes = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+    return _by_user(np.concatenate([old_codes, new_codes]), n_users)
+
+
+def _grow(counts, n_users, n_days=None):
+    # zero pads the user axis (and the day axis) of a count array
+    pad = [(0, n_users - counts.shape[0])] + [(0, 0)] * (counts.ndim - 1)
+    if n_days is not None:
+        pad[1] = (0, n_days - counts.shape[1])
+    return np.pad(counts, pad)
+
+
+def _ranked(ids):
+    # distinct ids by count, ties broken by first use like Counter.most_common
+    ids, first, counts = np.unique(ids, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    return ids[order], counts[order]
+
+
+def warm_up():
+    """Loads every lazily built resource now instead of on the first chat"""
+    stop_words()
+    emoji_pattern()
+    url_extractor()
+    sentiment_analyzer()
+
+
+def get(df):
+    """Returns the ChatIndex for a parsed chat, building it on first use"""
+    key = id(df)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = ChatIndex(df)
+                _register(df, index)
+    return index
+
+
+def _register(df, index):
+    key = id(df)
+    _indexes[key] = index
+    weakref.finalize(df, _indexes.pop, key, None)
+
+
+def attach(chat, index):
+    """Makes get(chat) return index, for chats that aren't a parsed DataFrame (see store.StoredChat)"""
+    with _indexes_lock:
+        _register(chat, index)
+
+
+def nbytes(df):
+    """Bytes held by the arrays of the parts of df's index built so far, 0 without an index"""
+    index = _indexes.get(id(df))
+    return index.nbytes() if index is not None else 0
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.Index):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return 0
+
+
+def extend(old_df, df, new_rows):
+    """Index of df (old_df followed by new_rows), grown from what old_df's index already built
+
+    old_df's index is left as it was: old_df is still in the shared caches
+    and other sessions may be reading its parts right now.
+    """
+    old = _indexes.get(id(old_df))
+    if old is None:
+        return get(df)
+    index = old.extended(df, new_rows)
+    with _indexes_lock:
+        _register(df, index)
+    return index
+
+
+class ChatIndex:
+    """Everything helper precomputes for one chat, each piece built lazily"""
+
+    PARTS = ('tokens', 'stats', 'search', 'emojis', 'sentiment', 'cube')
+
+    def __init__(self, df):
+        self.df = weakref.proxy(df)
+        self._tokens = None
+        self._cube = None
+        self._stats = None
+        self._emojis = None
+        self._sentiment = None
+        self._search = None
+        # the app computes its sections on several threads, each part is still built once
+        self._locks = {name: threading.Lock() for name in self.PARTS}
+
+    def extended(self, df, new_rows):
+        """New index of df (this chat followed by new_rows), this one isn't changed
+
+        Every built part is copied and the copy extended. A part's extend only
+        ever assigns new arrays and dicts to it, never changes the shared ones
+        in place, so a shallow copy is enough.
+        """
+        index = ChatIndex(df)
+        # tokens comes first: stats and search read the new rows' tokens from it
+        for name in self.PARTS:
+            part = getattr(self, '_' + name)
+            if part is None:
+                continue
+            part = copy.copy(part)
+            if getattr(part, 'tokens', None) is not None:
+                part.tokens = index._tokens
+            with diagnostics.stage('index.' + name + '.extend', rows=len(new_rows)):
+                part.extend(new_rows)
+            setattr(index, '_' + name, part)
+        return index
+
+    def nbytes(self):
+        # parts referring to another part (stats and search to tokens) don't count it again
+        return sum(_nbytes(vars(getattr(self, '_' + name))) for name in self.PARTS
+                   if getattr(self, '_' + name) is not None)
+
+    def _part(self, name, build):
+        # parts already built are returned without taking the lock
+        part = getattr(self, '_' + name)
+        if part is None:
+            with self._locks[name]:
+                part = getattr(self, '_' + name)
+                if part is None:
+                    with diagnostics.stage('index.' + name, rows=len(self.df)):
+                        part = build()
+                    setattr(self, '_' + name, part)
+        return part
+
+    @property
+    def tokens(self):
+        return self._part('tokens', lambda: TokenIndex(self.df))
+
+    @property
+    def stats(self):
+        tokens = self.tokens
+        return self._part('stats', lambda: MessageStats(self.df, tokens))
+
+    @property
+    def search(self):
+        tokens = self.tokens
+        return self._part('search', lambda: SearchIndex(self.df, tokens))
+
+    @property
+    def emojis(self):
+        return self._part('emojis', lambda: EmojiIndex(self.df))
+
+    @property
+    def sentiment(self):
+        return self._part('sentiment', lambda: SentimentScores(self.df))
+
+    @property
+    def cube(self):
+        return self._part('cube', lambda: ActivityCube(self.df))
+
+    def messages(self, rows):
+        """date, user and message of the given rows of the chat"""
+        return self.df.iloc[rows][['date', 'user', 'message']]
+
+
+def _tokenize(messages):
+    lengths = np.zeros(len(messages), dtype=np.int64)
+    tokens = []
+    for i, message in enumerate(messages):
+        words = message.lower().split()
+        lengths[i] = len(words)
+        tokens.extend(words)
+    return lengths, tokens
+
+
+class TokenIndex:
+    """Lowercased whitespace tokens of every message, tokenized once
+
+    ids holds the token ids of all messages back to back in chat order and
+    offsets[i]:offsets[i + 1] is the range of message i. The same ids are
+    also kept sorted by user so one user's tokens are a single slice.
+    """
+
+    def __init__(self, df):
+        lengths, tokens = _tokenize(df['message'])
+        ids, words = pd.factorize(pd.Series(tokens, dtype=object), sort=False)
+        del tokens
+        self.ids = ids.astype(np.int32)
+        self.words = np.asarray(words, dtype=object)
+        self.offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+
+        stop = stop_words()
+        self.stop = np.fromiter((w in stop for w in self.words), dtype=bool, count=len(self.words))
+
+        # tokens that count as content: no stop words, media or notifications
+        user_codes, self.users = _users(df)
+        self.keep = np.repeat(_content(df), lengths) & ~self.stop[self.ids]
+
+        order, self.user_bounds = _by_user(np.repeat(user_codes, lengths), len(self.users))
+        self.ids_by_user = self.ids[order]
+        self.keep_by_user = self.keep[order]
+
+        self._vocab = None
+        self._tables = {}
+
+    @property
+    def vocab(self):
+        """word -> id"""
+        if self._vocab is None:
+            self._vocab = {word: i for i, word in enumerate(self.words)}
+        return self._vocab
+
+    def extend(self, new_rows):
+        lengths, tokens = _tokenize(new_rows['message'])
+        vocab = dict(self.vocab)
+        n_words = len(vocab)
+        ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in tokens), dtype=np.int32, count=len(tokens))
+        del tokens
+        if len(vocab) > n_words:
+            added = np.asarray(list(vocab)[n_words:], dtype=object)
+            stop = stop_words()
+            self.words = np.concatenate([self.words, added])
+            self.stop = np.concatenate([self.stop, [w in stop for w in added]])
+
+        self.ids = np.concatenate([self.ids, ids])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        keep = np.repeat(_content(new_rows), lengths) & ~self.stop[ids]
+        self.keep = np.concatenate([self.keep, keep])
+
+        user_codes, self.users = _add_users(self.users, new_rows['user'])
+        order, self.user_bounds = _append_by_user(self.user_bounds, np.repeat(user_codes, lengths), len(self.users))
+        self.ids_by_user = np.concatenate([self.ids_by_user, ids])[order]
+        self.keep_by_user = np.concatenate([self.keep_by_user, keep])[order]
+        self._vocab = vocab
+        self._tables = {}
+
+    def _user_slice(self, user):
+        code = self.users.get_indexer([user])[0]
+        if code < 0:
+            return slice(0, 0)
+        return slice(self.user_bounds[code], self.user_bounds[code + 1])
+
+    def content_ids(self, selected_user):
+        """Ids of the non stop word tokens of a user's text messages, in chat order"""
+        if selected_user == 'Overall':
+            return self.ids[self.keep]
+        s = self._user_slice(selected_user)
+        return self.ids_by_user[s][self.keep_by_user[s]]
+
+    def frequencies(self, selected_user):
+        """(words, counts) for a user, most used first, ties by first use"""
+        table = self._tables.get(selected_user)
+        if table is None:
+            ids, counts = _ranked(self.content_ids(selected_user))
+            table = (self.words[ids], counts)
+            self._tables[selected_user] = table
+        return table
+
+
+def parse_query(query):
+    """Groups of terms for SearchIndex.find: 'movie tonight OR cricket' -> [['movie', 'tonight'], ['cricket']]"""
+    groups = []
+    for part in re.split(r'\s+OR\s+', query.strip()):
+        terms = SEARCH_TERM.findall(re.sub(r'\bAND\b', ' ', part).lower())
+        if terms:
+            groups.append(terms)
+    return groups
+
+
+class SearchIndex:
+    """Inverted index of the terms in every message, built from the token index
+
+    rows[bounds[t]:bounds[t + 1]] are the rows containing term t, sorted and
+    each once, so a query only merges a few sorted arrays. The user and date
+    of every row are kept for the filters.
+    """
+
+    def __init__(self, df, tokens):
+        self.tokens = tokens
+        self.terms = {}
+        # terms of every distinct token: term_ids[term_offsets[i]:term_offsets[i + 1]]
+        self.term_offsets = np.zeros(1, dtype=np.int64)
+        self.term_ids = np.zeros(0, dtype=np.int32)
+        self.bounds = np.zeros(1, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.users = pd.Index([], dtype=object)
+        self.user_codes = np.zeros(0, dtype=np.int32)
+        self.dates = np.zeros(0, dtype='datetime64[us]')
+        self.extend(df)
+
+    def _map_tokens(self):
+        # terms of the tokens added to the token index since last time
+        terms = self.terms = dict(self.terms)
+        found = [[terms.setdefault(term, len(terms)) for term in SEARCH_TERM.findall(word)]
+                 for word in self.tokens.words[len(self.term_offsets) - 1:]]
+        counts = np.fromiter((len(ids) for ids in found), dtype=np.int64, count=len(found))
+        self.term_offsets = np.concatenate([self.term_offsets, self.term_offsets[-1] + np.cumsum(counts)])
+        self.term_ids = np.concatenate([self.term_ids, np.fromiter(
+            (i for ids in found for i in ids), dtype=np.int32, count=int(counts.sum()))])
+
+    def extend(self, new_rows):
+        # the token index already holds the new rows, they are its last offsets
+        self._map_tokens()
+        first_row = len(self.user_codes)
+        offsets = self.tokens.offsets[first_row:]
+        ids = self.tokens.ids[offsets[0]:]
+        row_of = np.repeat(np.arange(first_row, first_row + len(new_rows), dtype=np.int32), np.diff(offsets))
+
+        # one (term, row) pair per term of every token, grouped by term with rows in order
+        per_token = np.diff(self.term_offsets)[ids]
+        rows = np.repeat(row_of, per_token)
+        ends = np.cumsum(per_token)
+        nth = np.arange(len(rows)) - np.repeat(ends - per_token, per_token)
+        terms = self.term_ids[np.repeat(self.term_offsets[ids], per_token) + nth]
+        order = np.argsort(terms, kind='stable')
+        terms, rows = terms[order], rows[order]
+        first = np.ones(len(terms), dtype=bool)
+        first[1:] = (terms[1:] != terms[:-1]) | (rows[1:] != rows[:-1])
+        terms, rows = terms[first], rows[first]
+
+        # new rows come after all the old ones, so a stable sort by term keeps every list sorted
+        old_terms = np.repeat(np.arange(len(self.bounds) - 1, dtype=np.int32), np.diff(self.bounds))
+        terms = np.concatenate([old_terms, terms])
+        order = np.argsort(terms, kind='stable')
+        self.rows = np.concatenate([self.rows, rows])[order]
+        self.bounds = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.terms)), out=self.bounds[1:])
+
+        user_codes, self.users = _add_users(self.users, new_rows['user'])
+        self.user_codes = np.concatenate([self.user_codes, user_codes.astype(np.int32)])
+        self.dates = np.concatenate([self.dates, new_rows['date'].values.astype('datetime64[us]')])
+
+    def postings(self, term):
+        """Sorted rows containing term"""
+        t = self.terms.get(term)
+        if t is None:
+            return self.rows[:0]
+        return self.rows[self.bounds[t]:self.bounds[t + 1]]
+
+    def find(self, query, selected_user='Overall', start=None, end=None):
+        """Sorted rows matching query, sent by selected_user between the days start and end (both included)
+
+        Terms of the query must all be in a message; 'OR' between terms starts
+        another group, any of which may match. A query without terms matches
+        every message.
+        """
+        groups = parse_query(query)
+        if groups:
+            found = []
+            for terms in groups:
+                # rarest first, so the intersections stay small
+                lists = sorted((self.postings(term) for term in terms), key=len)
+                rows = lists[0]
+                for other in lists[1:]:
+                    rows = np.intersect1d(rows, other, assume_unique=True)
+                found.append(rows)
+            rows = found[0] if len(found) == 1 else np.unique(np.concatenate(found))
+        else:
+            rows = np.arange(len(self.user_codes), dtype=np.int32)
+
+        if selected_user != 'Overall':
+            code = self.users.get_indexer([selected_user])[0]
+            rows = rows[self.user_codes[rows] == code]
+        if start is not None:
+            rows = rows[self.dates[rows] >= np.datetime64(start, 'D')]
+        if end is not None:
+            rows = rows[self.dates[rows] < np.datetime64(end, 'D') + 1]
+        return rows
+
+
+def _find_emojis(df):
+    # (emoji, row's user) for every emoji in the chat, in order
+    user_codes, users = _users(df)
+    findall = emoji_pattern().findall
+    found = []
+    owners = []
+    for code, message in zip(user_codes, df['message'].values):
+        # every emoji has at least one non-ascii code point
+        if message.isascii():
+            continue
+        hits = findall(message)
+        if hits:
+            found.extend(hits)
+            owners.extend([users[code]] * len(hits))
+    return found, owners
+
+
+class EmojiIndex:
+    """Every emoji used in the chat, found in one scan and grouped by user"""
+
+    def __init__(self, df):
+        found, owners = _find_emojis(df)
+        ids, emojis = pd.factorize(pd.Series(found, dtype=object), sort=False)
+        self.emojis = np.asarray(emojis, dtype=object)
+        self.ids = ids.astype(np.int32)
+        owner_codes, self.users = _add_users(_users(df)[1], owners)
+        order, self.user_bounds = _by_user(owner_codes, len(self.users))
+        self.ids_by_user = self.ids[order]
+        self._tables = {}
+
+    def extend(self, new_rows):
+        found, owners = _find_emojis(new_rows)
+        known = {e: i for i, e in enumerate(self.emojis)}
+        n_emojis = len(known)
+        ids = np.fromiter((known.setdefault(e, len(known)) for e in found), dtype=np.int32, count=len(found))
+        if len(known) > n_emojis:
+            self.emojis = np.concatenate([self.emojis, np.asarray(list(known)[n_emojis:], dtype=object)])
+        self.ids = np.concatenate([self.ids, ids])
+
+        owner_codes, self.users = _add_users(self.users, owners)
+        _, self.users = _add_users(self.users, new_rows['user'])
+        order, self.user_bounds = _append_by_user(self.user_bounds, owner_codes, len(self.users))
+        self.ids_by_user = np.concatenate([self.ids_by_user, ids])[order]
+        self._tables = {}
+
+    def user_ids(self, selected_user):
+        if selected_user == 'Overall':
+            return self.ids
+        code = self.users.get_indexer([selected_user])[0]
+        if code < 0:
+            return self.ids[:0]
+        return self.ids_by_user[self.user_bounds[code]:self.user_bounds[code + 1]]
+
+    def frequencies(self, selected_user):
+        """(emojis, counts) for a user, most used first, ties by first use"""
+        table = self._tables.get(selected_user)
+        if table is None:
+            ids, counts = _ranked(self.user_ids(selected_user))
+            table = (self.emojis[ids], counts)
+            self._tables[selected_user] = table
+        return table
+
+    def top_by_user(self):
+        """Most used emoji of every user who used one, ties by first use"""
+        n = len(self.emojis)
+        if not n:
+            return pd.Series([], index=pd.Index([], dtype=object, name='user'), dtype=object, name='top_emoji')
+        owners = np.repeat(np.arange(len(self.users)), np.diff(self.user_bounds))
+        keys, first, counts = np.unique(owners * n + self.ids_by_user, return_index=True, return_counts=True)
+        # most used first within each user, ties by first use, and each user's first row wins
+        order = np.lexsort((first, -counts, keys // n))
+        keys = keys[order]
+        users, top = np.unique(keys // n, return_index=True)
+        return pd.Series(self.emojis[keys[top] % n], index=pd.Index(self.users[users], name='user'), name='top_emoji')
+
+
+class SentimentScores:
+    """VADER compound score of every text message, each distinct text scored once
+
+    compound lines up with the rows of the chat (NaN for media and group
+    notifications) and by_user holds the Positive/Negative/Neutral counts.
+    """
+
+    def __init__(self, df):
+        self.users = pd.Index([], dtype=object)
+        self.compound = np.zeros(0)
+        self.by_user = np.zeros((0, 3), dtype=np.int64)
+        self.extend(df)
+
+    def extend(self, new_rows):
+        user_codes, self.users = _add_users(self.users, new_rows['user'])
+        content = _content(new_rows)
+
+        # 'ok', 'haha' and friends make up a good share of any group chat
+        text_codes, texts = pd.factorize(new_rows['message'].values[content], sort=False)
+        scores = score_texts(list(texts))
+        compound = np.full(len(new_rows), np.nan)
+        compound[content] = scores[text_codes]
+        self.compound = np.concatenate([self.compound, compound])
+
+        labels = np.where(scores[text_codes] > 0.05, 0, np.where(scores[text_codes] < -0.05, 1, 2))
+        counts = np.bincount(user_codes[content] * 3 + labels, minlength=len(self.users) * 3)
+        self.by_user = _grow(self.by_user, len(self.users)) + counts.reshape(len(self.users), 3)
+
+    def shares(self):
+        """Percent of every user's text messages that are Positive/Negative/Neutral"""
+        totals = self.by_user.sum(axis=1, keepdims=True)
+        shares = np.divide(self.by_user * 100.0, totals, out=np.zeros(self.by_user.shape), where=totals > 0)
+        return pd.DataFrame(shares.round(1), index=pd.Index(self.users, name='user'), columns=SENTIMENT_LABELS)
+
+    def split(self, selected_user):
+        if selected_user == 'Overall':
+            counts = self.by_user.sum(axis=0)
+        else:
+            code = self.users.get_indexer([selected_user])[0]
+            counts = self.by_user[code] if code >= 0 else np.zeros(3, dtype=np.int64)
+        return {label: int(n) for label, n in zip(SENTIMENT_LABELS, counts)}
+
+
+class MessageStats:
+    """Messages, words, media and links for every user, counted in one pass"""
+
+    COLUMNS = ['messages', 'words', 'media', 'links']
+
+    def __init__(self, df, tokens):
+        self.tokens = tokens
+        self.users = pd.Index([], dtype=object)
+        self.counts = np.zeros((0, 4), dtype=np.int64)
+        # links of every row, URL extraction being the slow part of the counts
+        self.row_links = np.zeros(0, dtype=np.int32)
+        self.extend(df)
+
+    def extend(self, new_rows):
+        user_codes, self.users = _add_users(self.users, new_rows['user'])
+        n_users = len(self.users)
+        # the token index already holds the new rows, they are its last offsets
+        words = np.diff(self.tokens.offsets[len(self.tokens.offsets) - len(new_rows) - 1:])
+        media = new_rows['message'].values == MEDIA_MESSAGE
+        links = count_links(new_rows['message'].values)
+        self.row_links = np.concatenate([self.row_links, links])
+
+        counts = np.stack([
+            np.bincount(user_codes, minlength=n_users),
+            np.bincount(user_codes, weights=words, minlength=n_users),
+            np.bincount(user_codes, weights=media, minlength=n_users),
+            np.bincount(user_codes, weights=links, minlength=n_users)
+        ], axis=1).astype(np.int64)
+        self.counts = _grow(self.counts, n_users) + counts
+
+    @classmethod
+    def from_counts(cls, users, counts):
+        """Stats counted elsewhere, one row of COLUMNS per user"""
+        stats = cls.__new__(cls)
+        stats.tokens = None
+        stats.row_links = None
+        stats.users = pd.Index(users, dtype=object)
+        stats.counts = np.asarray(counts, dtype=np.int64).reshape(len(stats.users), len(cls.COLUMNS))
+        return stats
+
+    @property
+    def by_user(self):
+        return pd.DataFrame(self.counts, index=pd.Index(self.users, name='user'), columns=self.COLUMNS)
+
+    def messages_by_user(self):
+        """Messages of every user, most first, ties in order of first message like value_counts"""
+        counts = pd.Series(self.counts[:, 0], index=pd.Index(self.users, name='user'), name='count')
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def get(self, selected_user):
+        """(messages, words, media, links) for a user or 'Overall'"""
+        if selected_user == 'Overall':
+            row = self.counts.sum(axis=0)
+        else:
+            code = self.users.get_indexer([selected_user])[0]
+            if code < 0:
+                return 0, 0, 0, 0
+            row = self.counts[code]
+        return tuple(int(n) for n in row)
+
+
+def _first_seen_order(keys, counts):
+    # value_counts lists labels in order of first appearance before sorting,
+    # and the chat is chronological so the first non-zero bucket is that
+    seen = np.flatnonzero(counts)
+    _, first = np.unique(keys[seen], return_index=True)
+    return keys[seen][np.sort(first)]
+
+
+class ActivityCube:
+    """Message counts per (user, day) and per (user, weekday, hour)
+
+    Weekday, month and year all follow from the day, so those two arrays
+    are enough for every timeline and activity helper. Users are rows and
+    'Overall' is their sum, so any selection is a single row lookup.
+    """
+
+    def __init__(self, df):
+        days = df['date'].values.astype('datetime64[D]')
+        self.first_day = days.min() if len(days) else np.datetime64('1970-01-01', 'D')
+        self.users = pd.Index([], dtype=object)
+        self.days = np.zeros((0, 0), dtype=np.int32)
+        self.hours = np.zeros((0, 7, 24), dtype=np.int32)
+        self.extend(df)
+
+    def extend(self, new_rows):
+        user_codes, self.users = _add_users(self.users, new_rows['user'])
+        n_users = len(self.users)
+
+        days = new_rows['date'].values.astype('datetime64[D]')
+        if len(days) and days.min() < self.first_day:
+            # only for exports that aren't in order; shift the day axis back
+            shift = int((self.first_day - days.min()).astype(np.int64))
+            self.days = np.pad(self.days, [(0, 0), (shift, 0)])
+            self.first_day = days.min()
+        day_codes = (days - self.first_day).astype(np.int64)
+        n_days = max(self.days.shape[1], int(day_codes.max()) + 1 if len(days) else 0)
+
+        self.days = _grow(self.days, n_users, n_days) + np.bincount(
+            user_codes * n_days + day_codes, minlength=n_users * n_days).astype(np.int32).reshape(n_users, n_days)
+        week_hours = new_rows['date'].dt.dayofweek.values * 24 + new_rows['date'].dt.hour.values
+        self.hours = _grow(self.hours, n_users) + np.bincount(
+            user_codes * 168 + week_hours, minlength=n_users * 168).astype(np.int32).reshape(n_users, 7, 24)
+        self._calendar(n_days)
+
+    @classmethod
+    def from_counts(cls, users, first_day, days, hours):
+        """Cube of counts made elsewhere: (users, days from first_day) and (users, 7, 24)"""
+        cube = cls.__new__(cls)
+        cube.users = pd.Index(users, dtype=object)
+        cube.first_day = np.datetime64(first_day, 'D')
+        cube.days = np.asarray(days, dtype=np.int32)
+        cube.hours = np.asarray(hours, dtype=np.int32)
+        cube._calendar(cube.days.shape[1])
+        return cube
+
+    def _calendar(self, n_days):
+        # calendar of the day axis
+        self.dates = self.first_day + np.arange(n_days)
+        months = self.dates.astype('datetime64[M]').astype(np.int64)
+        self.weekday = (self.dates.astype(np.int64) + 3) % 7
+        self.month_num = months % 12 + 1
+        self.year = months // 12 + 1970
+        self.month_code = months - months.min() if n_days else months
+
+        self._overall = None
+
+    def _row(self, selected_user):
+        if selected_user == 'Overall':
+            if self._overall is None:
+                self._overall = (self.days.sum(axis=0), self.hours.sum(axis=0))
+            return self._overall
+        code = self.users.get_indexer([selected_user])[0]
+        if code < 0:
+            return np.zeros(len(self.dates), dtype=np.int32), np.zeros((7, 24), dtype=np.int32)
+        return self.days[code], self.hours[code]
+
+    def busiest_hours(self):
+        """Hour period every user sends the most messages in, earliest on ties"""
+        hours = self.hours.sum(axis=1)
+        return pd.Series(np.asarray(PERIODS, dtype=object)[hours.argmax(axis=1)],
+                         index=pd.Index(self.users, name='user'), name='busiest_hour')
+
+    def monthly(self, selected_user):
+        days, _ = self._row(selected_user)
+        counts = np.bincount(self.month_code, weights=days).astype(np.int64)
+        seen = np.flatnonzero(counts)
+        # first day of each calendar month carries its year and month
+        first = np.searchsorted(self.month_code, seen)
+        year = self.year[first].astype(np.int32)
+        month_num = self.month_num[first].astype(np.int32)
+        month = pd.Series(np.asarray(MONTH_NAMES, dtype=object)[month_num - 1], dtype=str)
+        timeline = pd.DataFrame({
+            'year': year,
+            'month_num': month_num,
+            'month': month,
+            'message': counts[seen]
+        })
+        timeline['time'] = timeline['month'] + '-' + timeline['year'].astype(str)
+        return timeline
+
+    def daily(self, selected_user):
+        days, _ = self._row(selected_user)
+        seen = np.flatnonzero(days)
+        return pd.DataFrame({
+            'day-date': self.dates[seen].astype(object),
+            'message': days[seen].astype(np.int64)
+        })
+
+    def weekly(self, selected_user):
+        days, hours = self._row(selected_user)
+        counts = hours.sum(axis=1).astype(np.int64)
+        order = _first_seen_order(self.weekday, days)
+        index = pd.Index([DAY_NAMES[d] for d in order], dtype=str, name='day_name')
+        return pd.Series(counts[order], index=index, name='count').sort_values(ascending=False, kind='stable')
+
+    def month_of_year(self, selected_user):
+        days, _ = self._row(selected_user)
+        counts = np.bincount(self.month_num - 1, weights=days, minlength=12).astype(np.int64)
+        order = _first_seen_order(self.month_num - 1, days)
+        index = pd.Index([MONTH_NAMES[m] for m in order], dtype=str, name='month')
+        return pd.Series(counts[order], index=index, name='count').sort_values(ascending=False, kind='stable')
+
+    def heatmap(self, selected_user):
+        _, hours = self._row(selected_user)
+        rows = np.flatnonzero(hours.sum(axis=1))
+        cols = np.flatnonzero(hours.sum(axis=0))
+        # pivot_table sorts both axes by label
+        rows = sorted(rows, key=lambda d: DAY_NAMES[d])
+        cols = sorted(cols, key=lambda h: PERIODS[h])
+        counts = hours[np.ix_(rows, cols)].astype(np.int64)
+        if (counts == 0).any():
+            counts = counts.astype(np.float64)
+        return pd.DataFrame(counts,
+                            index=pd.Index([DAY_NAMES[d] for d in rows], dtype=str, name='day_name'),
+                            columns=pd.Index([PERIODS[h] for h in cols], dtype=str, name='period'))
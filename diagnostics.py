@@ -0,0 +1,91 @@
+"""Duration, rows and memory of each stage of an analysis
+
+    with diagnostics.stage('preprocess') as record:
+        df = preprocessor.preprocess(data)
+        record['rows'] = len(df)
+
+Every finished stage is added to the current trace (see start_trace) and
+logged as one JSON line on the 'chat_analyzer.stages' logger. Set
+CHAT_STAGE_LOG to a file path, or to '-' for stderr, to collect them.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger('chat_analyzer.stages')
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_trace = contextvars.ContextVar('diagnostics_trace', default=None)
+_parent = contextvars.ContextVar('diagnostics_parent', default=None)
+
+
+def _configure(target=os.environ.get('CHAT_STAGE_LOG')):
+    if not target:
+        return
+    handler = logging.StreamHandler(sys.stderr) if target == '-' else logging.FileHandler(target)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+_configure()
+
+
+def rss():
+    """Resident memory of this process in bytes, or None where it can't be read cheaply"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_trace():
+    """Collects the stages run from here on in this thread, returns the list they go to"""
+    stages = []
+    _trace.set(stages)
+    return stages
+
+
+@contextlib.contextmanager
+def stage(name, rows=None, **fields):
+    """Times the block, rows and any extra fields can still be set on the yielded record"""
+    record = {'stage': name, 'parent': _parent.get(), 'rows': rows}
+    record.update(fields)
+    token = _parent.set(name)
+    before = rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        after = rss()
+        # RSS rather than tracemalloc, which would slow every stage down
+        record['memory_delta_mb'] = None if before is None or after is None else (after - before) / 2 ** 20
+        _parent.reset(token)
+        _finish(record)
+
+
+def add(name, seconds, rows=None, **fields):
+    """Records a stage timed elsewhere, e.g. summed over the blocks of a stream"""
+    record = {'stage': name, 'parent': _parent.get(), 'rows': rows}
+    record.update(fields)
+    record['seconds'] = seconds
+    record['memory_delta_mb'] = None
+    _finish(record)
+
+
+def _finish(record):
+    stages = _trace.get()
+    if stages is not None:
+        stages.append(record)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record, default=str))
@@ -1,177 +1,144 @@
+import heapq
+import re
 import matplotlib.pyplot as plt
-from urlextract import URLExtract
 from wordcloud import WordCloud
-from collections import Counter
 import pandas as pd
-import emoji
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
-
-nltk.download('vader_lexicon')
-
-sia = SentimentIntensityAnalyzer()
-
-extract = URLExtract()
+import chat_index
+import preprocessor
+from chat_index import warm_up
+
+# WordCloud never draws more than its max_words anyway
+WORDCLOUD_WORDS = 200
+# distinct tokens (most used first) the word cloud is built from
+WORDCLOUD_TOKENS = 5000
+WORDCLOUD_WORD = re.compile(r"\w[\w']*")
+
+def append_messages(df, data):
+    # a longer export of the same chat: parse only the new tail and grow
+    # whatever was already precomputed for df instead of starting over
+    appended = preprocessor.append(df, data)
+    if appended is None:
+        return None
+    combined, new_rows = appended
+    chat_index.extend(df, combined, new_rows)
+    return combined
 
 def fetch_stats(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    num_messages = df.shape[0]
-
-    words = []
-    for message in df['message']:
-        words.extend(message.split())
-
-    #no. of media messages
-    num_media_messages = df[df['message'] == '<Media omitted>\n'].shape[0]
-
-    #no. of links
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
+    # messages, words, media and links for every user are counted once per chat
+    num_messages, words, num_media_messages, num_links = chat_index.get(df).stats.get(selected_user)
 
-
-
-    return num_messages, len(words), num_media_messages,len(links)
+    return num_messages, words, num_media_messages, num_links
 
 
 
 def most_busy_users(df):
-    x = df['user'].value_counts().head()
+    # the per-user counts fetch_stats already made, so a chat in a store.Store works too
+    counts = chat_index.get(df).stats.messages_by_user()
+    x = counts.head()
 
-    df=round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index().rename(
+    df=round((counts / counts.sum()) * 100, 2).reset_index().rename(
         columns={'user': 'name', 'count': 'percent'})
 
     return x,df
 
 
+def leaderboard(df):
+    # every participant side by side, taken from the per-user tables the index
+    # keeps anyway instead of running every helper once per user
+    index = chat_index.get(df)
+    board = index.stats.by_user
+    # same percent as most_busy_users
+    board.insert(1, 'percent', round(board['messages'] / board['messages'].sum() * 100, 2))
+    board = board.join(index.emojis.top_by_user()).join(index.sentiment.shares()).join(index.cube.busiest_hours())
+    board = board.drop(chat_index.NOTIFICATION_USER, errors='ignore')
+    board['top_emoji'] = board['top_emoji'].fillna('')
 
-def create_wordcloud(selected_user,df):
+    board = board[['messages', 'percent', 'words', 'media', 'links', 'top_emoji',
+                   'Positive', 'Neutral', 'Negative', 'busiest_hour']]
+    return board.sort_values('messages', ascending=False, kind='stable').rename_axis('name').reset_index()
 
-    # removing stupid words like hai haan aacha
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
 
-    #removing useless words
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-    # filtered group notification and media messages
-
-    def remove_stopwords(message):
-        y=[]
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
 
+def create_wordcloud(selected_user,df):
 
+    # built from the word counts the index already keeps per user, so the whole
+    # chat is never joined into one string and counted again by WordCloud
+    words, counts = chat_index.get(df).tokens.frequencies(selected_user)
 
-    wc = WordCloud(width=500,height=500,min_font_size=10,background_color='white')
-    temp['message'] = temp['message'].apply(remove_stopwords)
-    df_wc = wc.generate(temp['message'].str.cat(sep=' '))
+    wc = WordCloud(width=500,height=500,min_font_size=10,background_color='white',max_words=WORDCLOUD_WORDS)
+    df_wc = wc.generate_from_frequencies(cloud_frequencies(words, counts, wc.stopwords))
     return df_wc
 
-def most_commonwords(selected_user,df):
-
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
+def cloud_frequencies(words, counts, stopwords, limit=WORDCLOUD_WORDS):
+    # the clean up WordCloud.generate does (its word pattern, "'s", numbers,
+    # its stop words, plurals), but once per distinct word instead of per use;
+    # only the most used tokens are looked at, so this doesn't grow with the chat
+    freq = {}
+    for word, count in zip(words[:WORDCLOUD_TOKENS], counts[:WORDCLOUD_TOKENS]):
+        for part in WORDCLOUD_WORD.findall(word):
+            if part.endswith("'s"):
+                part = part[:-2]
+            if part.isdigit() or part in stopwords:
+                continue
+            freq[part] = freq.get(part, 0) + int(count)
+
+    # "cats" counts as "cat" when both are used
+    for word in [w for w in freq if w.endswith('s') and not w.endswith('ss') and w[:-1] in freq]:
+        freq[word[:-1]] += freq.pop(word)
+
+    return dict(heapq.nlargest(limit, freq.items(), key=lambda item: item[1]))
 
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-    # filtered group notification and media messages
+def most_commonwords(selected_user,df):
 
     # removing stupid words like hai haan aacha
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
-    #print(stop_words)
-
-    words = []
+    words, counts = chat_index.get(df).tokens.frequencies(selected_user)
 
-    for message in temp['message']:
-        for word in message.lower().split():
-            if word not in stop_words:
-                words.append(word)
-
-    return_df = pd.DataFrame(Counter(words).most_common(20))
+    return_df = pd.DataFrame({0: words[:20], 1: counts[:20]})
     return return_df
 
 
 def commonly_used_emojis(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if emoji.is_emoji(c)])
+    # whole emoji sequences (skin tones, families, flags), counted once per chat
+    emojis, counts = chat_index.get(df).emojis.frequencies(selected_user)
 
-    datafr=pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
+    datafr=pd.DataFrame({0: emojis, 1: counts})
     return datafr
 
 
 def montly_data(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append((str(timeline['month'][i]) + "-" + str(timeline['year'][i])))
-    timeline['time'] = time
+    timeline = chat_index.get(df).cube.monthly(selected_user)
     return timeline
 
 
 def daily_data(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    daily_timeline = df.groupby('day-date').count()['message'].reset_index()
+    daily_timeline = chat_index.get(df).cube.daily(selected_user)
     return daily_timeline
 
 
 def week_activity(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    weekly_data = df['day_name'].value_counts()
+    weekly_data = chat_index.get(df).cube.weekly(selected_user)
     return weekly_data
 
 def month_activity(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    month_activity_data = df['month'].value_counts()
+    month_activity_data = chat_index.get(df).cube.month_of_year(selected_user)
     return month_activity_data
 
 
 def hourly_activity(selected_user,df):
-    if selected_user != 'Overall':
-        df=df[df['user'] == selected_user]
-
-    activity_map=df.pivot_table(index='day_name',columns='period',values='message',aggfunc='count').fillna(0)
+    activity_map = chat_index.get(df).cube.heatmap(selected_user)
     return activity_map
 
 
+def search_messages(selected_user, df, query, start=None, end=None):
+    # looked up in an inverted index of the chat's words instead of running
+    # str.contains over every message; start and end days are included
+    index = chat_index.get(df)
+    rows = index.search.find(query, selected_user, start, end)
+    return index.messages(rows)
+
+
 def sentiment_analysis(selected_user, df):
-    if selected_user != "Overall":
-        df = df[df['user'] == selected_user]
-
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-
-    sentiments = {"Positive": 0, "Negative": 0, "Neutral": 0}
-
-    for message in temp['message']:
-        score = sia.polarity_scores(message)['compound']
-        if score > 0.05:
-            sentiments["Positive"] += 1
-        elif score < -0.05:
-            sentiments["Negative"] += 1
-        else:
-            sentiments["Neutral"] += 1
+    # every message is scored once per chat, this only counts the labels
+    sentiments = chat_index.get(df).sentiment.split(selected_user)
 
     return sentiments
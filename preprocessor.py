@@ -1,64 +1,482 @@
+import codecs
+import itertools
+import mmap
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 import re
 
-def preprocess(data):
-    pattern = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s'
+import diagnostics
 
-    messages = re.split(pattern, data)[1:]
+AUTHOR = re.compile(r'([\w\W]+?):\s')
 
+# header and to_datetime format of one kind of export, see export_format()
+ExportFormat = namedtuple('ExportFormat', ['style', 'date_format', 'header'])
 
+# 'android': "31/12/2023, 21:05 - user: text", 'ios': "[31/12/23, 21:05:09] user: text"
+STYLES = {
+    'android': r'(%s)\s-\s',
+    'ios': r'\u200e?\[(%s)\]\s',
+}
+_DIRECTIVES = {
+    '%d': r'\d{1,2}', '%m': r'\d{1,2}', '%Y': r'\d{4}', '%y': r'\d{2}',
+    '%H': r'\d{1,2}', '%I': r'\d{1,2}', '%M': r'\d{2}', '%S': r'\d{2}', '%p': r'[AaPp][Mm]',
+}
 
-    dates = re.findall(pattern, data)
+# loose enough for every style, only run over the first lines to tell which one it is
+SNIFF_HEADER = re.compile(
+    r'^\u200e?(\[)?(\d{1,2})([/.-])(\d{1,2})\3(\d{4}|\d{2})(,?)\s(\d{1,2}):(\d{2})(:\d{2})?'
+    r'(?:(\s?)([AaPp][Mm]))?(?(1)\]\s|\s-\s)', re.MULTILINE)
+SNIFF_LINES = 500
+SNIFF_CHARS = 1 << 16
 
-    df = pd.DataFrame({
-        'messages': messages,
-        'message_date': dates
-    })
-    df['message_date'] = pd.to_datetime(
-        df['message_date'],
-        format='%d/%m/%Y, %H:%M - '
-    )
-    df.rename(columns={'message_date': 'date'}, inplace=True)
 
+@lru_cache(maxsize=None)
+def export_format(style, date_format):
+    """ExportFormat for a style in STYLES and a strptime format of its dates"""
+    date_pattern = ''.join(
+        _DIRECTIVES.get(token) or (r'\s' if token == ' ' else re.escape(token))
+        for token in re.findall(r'%.|.', date_format, re.DOTALL))
+    return ExportFormat(style, date_format, re.compile(STYLES[style] % date_pattern))
+
+
+# every character \s matches in a str pattern (NBSP and the narrow one
+# iPhones put before AM/PM too), as UTF-8 for byte_header()
+_BYTE_SPACE = (rb'(?:[\t-\r\x1c-\x20]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]'
+               rb'|\xe2\x81\x9f|\xe3\x80\x80)')
+BYTE_STYLES = {
+    'android': rb'(%s)\s-\s',
+    'ios': rb'(?:\xe2\x80\x8e)?\[(%s)\]\s',
+}
+
+
+@lru_cache(maxsize=None)
+def byte_header(fmt):
+    """fmt.header for UTF-8 bytes rather than text, matching the same headers"""
+    date_pattern = b''.join(
+        _DIRECTIVES[token].encode() if token in _DIRECTIVES
+        else rb'\s' if token == ' ' else re.escape(token.encode('utf-8'))
+        for token in re.findall(r'%.|.', fmt.date_format, re.DOTALL))
+    pattern = BYTE_STYLES[fmt.style] % date_pattern
+    return re.compile(pattern.replace(rb'\s', _BYTE_SPACE))
+
+
+# the Android 24h export with 4 digit years, what exports looked like so far
+DATE_FORMAT = '%d/%m/%Y, %H:%M'
+ANDROID = export_format('android', DATE_FORMAT)
+# every message starts with this header, wherever it shows up in the text
+MESSAGE_START = ANDROID.header
+
+
+def sniff(sample):
+    """ExportFormat of a chat, worked out from the headers in its first lines
+
+    Falls back to ANDROID when no header is recognised. Day and month are
+    only read as month first when a first number never goes above 12 but
+    a second one does.
+    """
+    headers = list(itertools.islice(SNIFF_HEADER.finditer(sample[:SNIFF_CHARS]), SNIFF_LINES))
+    if not headers:
+        return ANDROID
+
+    # a quoted message can look like a header too, the first one decides
+    shape = lambda h: (h.group(1), h.group(3), len(h.group(5)), h.group(6), h.group(9) is None,
+                       h.group(10), h.group(11) is None)
+    headers = [h for h in headers if shape(h) == shape(headers[0])]
+    first = headers[0]
+
+    month_first = (max(int(h.group(2)) for h in headers) <= 12
+                   and max(int(h.group(4)) for h in headers) > 12)
+    sep = first.group(3)
+    date_format = (('%m' + sep + '%d') if month_first else ('%d' + sep + '%m')) + sep
+    date_format += '%Y' if len(first.group(5)) == 4 else '%y'
+    date_format += first.group(6) + ' '
+    date_format += '%I:%M' if first.group(11) else '%H:%M'
+    if first.group(9):
+        date_format += ':%S'
+    if first.group(11):
+        date_format += (' ' if first.group(10) else '') + '%p'
+    return export_format('ios' if first.group(1) else 'android', date_format)
+
+
+def format_of(df):
+    """ExportFormat a chat was parsed with, None for chats parsed before it was recorded"""
+    if 'export_style' not in df.attrs:
+        return None
+    return export_format(df.attrs['export_style'], df.attrs['date_format'])
+
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+# hour -> 'period' label, e.g. 13 -> '13-14'
+PERIODS = ['00-1'] + [str(h) + '-' + str(h + 1) for h in range(1, 23)] + ['23-00']
+
+BLOCK_SIZE = 1 << 20
+BATCH_SIZE = 50000
+
+# a header is at most ~20 chars, so anything further back than this
+# from the end of a block has already been scanned for good
+HEADER_MARGIN = 64
+
+# below this many bytes a chunk costs more to hand to a process than to parse here
+PARALLEL_CHUNK_BYTES = 1 << 23
+# processes preprocess_file() parses a big export on, None for one per CPU
+PARSE_WORKERS = None
+
+# encodings are told apart by a BOM or by this many first bytes
+ENCODING_SAMPLE = 1 << 16
+BOMS = [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')]
+# decodes any bytes, for exports that are neither UTF-8 nor UTF-16
+FALLBACK_ENCODING = 'latin-1'
+
+
+def detect_encoding(head):
+    """(encoding, BOM length) of an export from its first bytes
+
+    Android and iPhone export chats differently: UTF-8, or UTF-16 with or
+    without a BOM. The encoding is exact (the BOM is skipped rather than
+    left to the codec), so bytes appended to the same export later decode
+    with it too. Only ENCODING_SAMPLE bytes are looked at.
+    """
+    head = bytes(head[:ENCODING_SAMPLE])
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    # UTF-16 without a BOM: every ASCII character (the headers at least, in
+    # chats of any script) leaves a zero in the same byte of its pair, while
+    # UTF-8 text has next to no zeros at all
+    even, odd = head[0::2].count(0), head[1::2].count(0)
+    zeros, other = max(even, odd), min(even, odd)
+    if zeros > len(head) // 128 and other * 16 <= zeros:
+        return ('utf-16-be' if even > odd else 'utf-16-le'), 0
+    try:
+        # the sample may end halfway through a character
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8', 0
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING, 0
+
+
+def decode(raw_bytes):
+    """(text, encoding) of a whole export held in memory, see detect_encoding"""
+    encoding, bom = detect_encoding(raw_bytes)
+    try:
+        return str(memoryview(raw_bytes)[bom:], encoding), encoding
+    except UnicodeDecodeError:
+        # only the sample was checked, something further on isn't that encoding
+        return str(raw_bytes, FALLBACK_ENCODING), FALLBACK_ENCODING
+
+
+def _byte_blocks(source, block_size, skip):
+    if hasattr(source, 'read'):
+        source.seek(skip)
+        while True:
+            block = source.read(block_size)
+            if not block:
+                return
+            yield block
+    else:
+        # slices of a memoryview are views, nothing is copied
+        view = memoryview(source)[skip:]
+        for start in range(0, len(view), block_size):
+            yield view[start:start + block_size]
+
+
+def _text_blocks(source, encoding, skip, block_size):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    seconds = 0.0
+    size = 0
+    for block in _byte_blocks(source, block_size, skip):
+        start = time.perf_counter()
+        text = decoder.decode(block)
+        seconds += time.perf_counter() - start
+        size += len(block)
+        yield text
+    yield decoder.decode(b'', final=True)
+    diagnostics.add('decode', seconds, rows=size, encoding=encoding)
+
+
+def preprocess_bytes(source, block_size=BLOCK_SIZE):
+    """preprocess() of raw export bytes, decoded block by block while they are parsed
+
+    source is bytes, a memoryview (like an upload's getbuffer()) or a
+    seekable binary file (like a ZIP member), so the whole chat never sits
+    in memory as text next to its bytes. Returns (df, encoding).
+    """
+    if hasattr(source, 'read'):
+        head = source.read(ENCODING_SAMPLE)
+    else:
+        head = memoryview(source)[:ENCODING_SAMPLE]
+    encoding, bom = detect_encoding(head)
+    try:
+        return preprocess(_text_blocks(source, encoding, bom, block_size)), encoding
+    except UnicodeDecodeError:
+        # only the sample was checked, something further on isn't that encoding
+        return preprocess(_text_blocks(source, FALLBACK_ENCODING, 0, block_size)), FALLBACK_ENCODING
+
+
+def preprocess_file(path, batch_size=BATCH_SIZE, workers=None):
+    """preprocess_bytes() of an export on disk, memory-mapped instead of read in
+
+    Headers are found straight in the mapped UTF-8 bytes and only the
+    dates and bodies of the messages are decoded, so the file itself stays
+    in the page cache rather than on the heap. Big exports are cut into
+    chunks at message starts and parsed on up to `workers` processes.
+    UTF-16 exports are decoded block by block from the file like
+    preprocess_bytes() does. Returns (df, encoding).
+    """
+    if workers is None:
+        workers = PARSE_WORKERS or os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        encoding, bom = detect_encoding(f.read(ENCODING_SAMPLE))
+        # an empty file can't be mapped
+        if encoding != 'utf-8' or os.fstat(f.fileno()).st_size == 0:
+            f.seek(0)
+            return preprocess_bytes(f)
 
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # the sample may end halfway through a character
+            fmt = sniff(str(mapped[bom:bom + SNIFF_CHARS], 'utf-8', 'ignore'))
+            parts = min(workers, len(mapped) // PARALLEL_CHUNK_BYTES)
+            try:
+                if parts > 1:
+                    return _parse_chunks(path, mapped, fmt, bom, parts, batch_size), encoding
+                return _collect(iter_mapped(mapped, fmt, bom), fmt, batch_size), encoding
+            except UnicodeDecodeError:
+                # only the sample was checked, something further on isn't UTF-8
+                pass
+        f.seek(0)
+        return preprocess(_text_blocks(f, FALLBACK_ENCODING, 0, BLOCK_SIZE)), FALLBACK_ENCODING
 
-    users = []
-    messages = []
 
-    for msg in df['messages']:
-        entry = re.split(r'([\w\W]+?):\s', msg)
-        if entry[1:]:
-            users.append(entry[1])
-            messages.append(entry[2])
-        else:
-            users.append('group_notification')
-            messages.append(entry[0])
+def iter_mapped(data, fmt, start=0, end=None):
+    """iter_messages() of UTF-8 bytes (or an mmap of them) between start and end
 
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['messages'], inplace=True)
+    Every header starts with an ASCII character, which never shows up
+    inside a multi-byte one, so the bytes are scanned without decoding them.
+    """
+    if end is None:
+        end = len(data)
+    date = None
+    for header in byte_header(fmt).finditer(data, start, end):
+        if date is not None:
+            yield _split_author(date, str(data[body_start:header.start()], 'utf-8'))
+        date = str(header.group(1), 'utf-8')
+        body_start = header.end()
 
-    df['year'] = df['date'].dt.year
-    df['month_num'] = df['date'].dt.month
-    df['day-date'] = df['date'].dt.date
-    df['day_name'] = df['date'].dt.day_name()
-    df['month'] = df['date'].dt.month_name()
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
+    if date is not None:
+        yield _split_author(date, str(data[body_start:end], 'utf-8'))
 
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
 
-    df['period'] = period
+def chunk_bounds(data, fmt, parts, start=0):
+    """Offsets cutting data[start:] into at most `parts` chunks of about the same size
 
+    Every cut is a header at the start of a line that no other possible
+    header overlaps, so the serial scan finds it too and each chunk parses
+    on its own into exactly the messages the whole file has there.
+    """
+    header = byte_header(fmt)
+    bounds = [start]
+    for k in range(1, parts):
+        cut = _next_cut(data, header, max(bounds[-1] + 1, start + (len(data) - start) * k // parts))
+        if cut is None:
+            break
+        bounds.append(cut)
+    bounds.append(len(data))
+    return bounds
 
 
+def _next_cut(data, header, pos):
+    while True:
+        found = header.search(data, pos)
+        if found is None:
+            return None
+        cut = found.start()
+        # a header is shorter than HEADER_MARGIN, nothing further back can reach the cut
+        if data[cut - 1:cut] == b'\n' and not any(
+                (earlier := header.match(data, i)) and earlier.end() > cut
+                for i in range(max(0, cut - HEADER_MARGIN), cut)):
+            return cut
+        pos = cut + 1
 
 
+def _parse_chunk(path, fmt, start, end, batch_size):
+    # runs in a worker process, which maps the file itself instead of being sent the chunk
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return _collect(iter_mapped(mapped, fmt, start, end), fmt, batch_size)
+
+
+def _parse_chunks(path, mapped, fmt, start, parts, batch_size):
+    bounds = chunk_bounds(mapped, fmt, parts, start)
+    workers = len(bounds) - 1
+    with diagnostics.stage('parse chunks', bytes=len(mapped) - start, workers=workers) as record:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(_parse_chunk, [path] * workers, [fmt] * workers,
+                                   bounds[:-1], bounds[1:], [batch_size] * workers))
+
+        # users in order of first message over the whole chat, like the serial parse
+        users = frames[0]['user'].cat.categories.append([f['user'].cat.categories for f in frames[1:]]).unique()
+        for frame in frames:
+            frame['user'] = frame['user'].cat.set_categories(users)
+        df = pd.concat(frames, ignore_index=True)
+        df.attrs.update(frames[0].attrs)
+        record['rows'] = len(df)
+    return df
+
+
+def _blocks(data, block_size):
+    if isinstance(data, str):
+        yield data
+        return
+    if not hasattr(data, 'read'):
+        # blocks already read by _open or decoded by _text_blocks
+        yield from data
+        return
+    while True:
+        block = data.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def _open(data, block_size, fmt):
+    """(format, blocks), sniffing the format from the first block when it isn't given"""
+    blocks = _blocks(data, block_size)
+    if fmt is not None:
+        return fmt, blocks
+    first = next(blocks, '')
+    return sniff(first), itertools.chain([first], blocks)
+
+
+def _split_author(date, body):
+    entry = AUTHOR.match(body)
+    if entry:
+        return date, entry.group(1), body[entry.end():]
+    return date, 'group_notification', body
+
+
+def iter_messages(data, block_size=BLOCK_SIZE, fmt=None):
+    """Yields (date, user, message) for each message in a string or text stream
+
+    Only the message currently being read is kept in memory, so a file
+    object can be parsed without ever holding the whole chat as one string.
+    Dates are left as text in fmt.date_format (sniffed when fmt is None).
+    """
+    fmt, blocks = _open(data, block_size, fmt)
+    finditer = fmt.header.finditer
+    buf = ''
+    date = None
+    for block in blocks:
+        scan_from = max(0, len(buf) - HEADER_MARGIN)
+        buf = buf + block
+        body_start = 0
+        for header in finditer(buf, scan_from):
+            if date is not None:
+                yield _split_author(date, buf[body_start:header.start()])
+            date = header.group(1)
+            body_start = header.end()
+
+        # text before the first header isn't part of any message
+        if date is None:
+            body_start = max(0, len(buf) - HEADER_MARGIN)
+        buf = buf[body_start:]
+
+    if date is not None:
+        yield _split_author(date, buf)
+
+
+def _frame(dates, user_codes, messages, date_format):
+    with diagnostics.stage('dates', rows=len(dates)):
+        dates = pd.to_datetime(dates, format=date_format)
+    return pd.DataFrame({
+        'date': dates,
+        'user': np.asarray(user_codes, dtype=np.int32),
+        'message': messages
+    })
+
+
+def preprocess(data, batch_size=BATCH_SIZE, fmt=None):
+    # data can be the decoded chat or an open text file / stream,
+    # its export format is sniffed from the first lines unless given
+    fmt, blocks = _open(data, BLOCK_SIZE, fmt)
+    return _collect(iter_messages(blocks, fmt=fmt), fmt, batch_size)
+
+
+def _collect(parsed, fmt, batch_size=BATCH_SIZE):
+    # (date, user, message) tuples into the parsed chat, batch_size at a time
+    frames = []
+    # user -> code in order of first message, so each name is stored once
+    users = {}
+    dates, user_codes, messages = [], [], []
+    for date, user, message in parsed:
+        dates.append(date)
+        user_codes.append(users.setdefault(user, len(users)))
+        messages.append(message)
+        if len(dates) >= batch_size:
+            frames.append(_frame(dates, user_codes, messages, fmt.date_format))
+            dates, user_codes, messages = [], [], []
+
+    if dates or not frames:
+        frames.append(_frame(dates, user_codes, messages, fmt.date_format))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    df['user'] = pd.Categorical.from_codes(df['user'].values, categories=list(users))
+    return _add_columns(df, fmt)
+
+
+def from_rows(dates, users, messages, fmt=ANDROID):
+    """Parsed chat of messages kept elsewhere (e.g. in a store.Store), in chat order
+
+    Comes out exactly like preprocess(): the same columns, users as a
+    categorical in order of first message, and the export format in attrs.
+    """
+    codes, names = pd.factorize(np.asarray(users, dtype=object), sort=False)
+    df = pd.DataFrame({
+        'date': pd.to_datetime(dates).astype('datetime64[us]'),
+        'user': pd.Categorical.from_codes(codes.astype(np.int32), categories=list(names)),
+        'message': pd.Series(messages, dtype=str)
+    })
+    return _add_columns(df, fmt)
+
+
+def _add_columns(df, fmt):
+    # repeated labels are categoricals and the numbers small ints;
+    # the calendar day is just df['date'].dt.date when needed
+    df['year'] = df['date'].dt.year.astype(np.int16)
+    df['month_num'] = df['date'].dt.month.astype(np.int8)
+    df['day_name'] = pd.Categorical.from_codes(df['date'].dt.dayofweek.values, categories=DAY_NAMES)
+    df['month'] = pd.Categorical.from_codes(df['month_num'].values - 1, categories=MONTH_NAMES)
+    df['hour'] = df['date'].dt.hour.astype(np.int8)
+    df['minute'] = df['date'].dt.minute.astype(np.int8)
+    df['period'] = pd.Categorical.from_codes(df['hour'].values, categories=PERIODS)
+    # kept with the chat (and its disk cache) so later tails parse the same way
+    df.attrs['export_style'] = fmt.style
+    df.attrs['date_format'] = fmt.date_format
+
     return df
+
+
+def append(df, data):
+    """df followed by the messages in data, the new tail of a longer export
+
+    Returns (combined, new_rows), or None when data doesn't start right at
+    a message, since then the last message of df changes too and the whole
+    export has to be parsed again.
+    """
+    # a short tail can't tell dd/mm from mm/dd, the rest of the export already did
+    fmt = format_of(df) or ANDROID
+    if len(df) == 0 or not df['message'].iloc[-1].endswith('\n') or not fmt.header.match(data):
+        return None
+
+    new_rows = preprocess(data, fmt=fmt)
+    users = df['user'].cat.categories.append(new_rows['user'].cat.categories).unique()
+    old = df.assign(user=df['user'].cat.set_categories(users))
+    new_rows['user'] = new_rows['user'].cat.set_categories(users)
+    new_rows.index += len(df)
+    return pd.concat([old, new_rows]), new_rows
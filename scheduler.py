@@ -0,0 +1,48 @@
+"""Runs the independent sections of an analysis side by side
+
+    analysis = scheduler.Analysis(executor)
+    analysis.submit('overview', helper.fetch_stats, 'Overall', df)
+    analysis.submit('sentiment', helper.sentiment_analysis, 'Overall', df)
+    for name, future in analysis.completed():
+        ...  # draw the section, quickest first
+
+Every section only reads the parsed chat, so none waits for another.
+Threads rather than processes: the chat and its index stay shared instead of
+being pickled to every worker, numpy and PIL let go of the GIL for the heavy
+parts, and big chats already score sentiment in their own processes.
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# threads shared by every session; threads beyond the CPUs only time-slice,
+# which makes the quick sections wait on the slow ones
+WORKERS = int(os.environ.get('CHAT_ANALYSIS_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+def executor(workers=WORKERS):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+
+
+class Analysis:
+    """Sections of one analysis submitted to an executor, handed back as they finish"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._names = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def submit(self, name, func, *args):
+        # run in a copy of the caller's context, so diagnostics stages of the
+        # section end up in the caller's trace under the caller's stage
+        context = contextvars.copy_context()
+        future = self.executor.submit(context.run, func, *args)
+        self._names[future] = name
+        return future
+
+    def completed(self):
+        """(name, future) of every section, in the order they finish"""
+        for future in as_completed(self._names):
+            yield self._names[future], future
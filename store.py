@@ -0,0 +1,322 @@
+"""Parsed chats kept in a local SQLite database, for questions across many of them
+
+    with store.Store('chats.db') as db:
+        db.add_chat('family', preprocessor.preprocess(data))
+        db.query("SELECT user, month, SUM(messages) AS messages "
+                 "FROM monthly_counts GROUP BY user, month")
+        helper.fetch_stats('Overall', db.chat('family'))
+
+    python store.py chats.db "SELECT chat, month, SUM(messages) FROM monthly_counts GROUP BY 1, 2"
+
+Every message is stored with indexes on (chat, date), (chat, user, date) and
+(user, date), and each chat's counts per user and day (daily_counts) and per
+user, weekday and hour (hourly_counts) are added up once when it is stored.
+A StoredChat can be handed to the helper functions in place of a DataFrame:
+stats, busy users, timelines and activity are then read from those tables,
+and only words, emojis, sentiment and search read the chat's messages back.
+"""
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import chat_index
+import diagnostics
+import preprocessor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT,
+    export_style TEXT,
+    date_format TEXT,
+    messages INTEGER NOT NULL,
+    first_date TEXT,
+    last_date TEXT,
+    added TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- one row per name, so the same person can be followed across chats
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+-- users of each chat in order of their first message
+CREATE TABLE IF NOT EXISTS chat_users (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+
+-- id follows the order of the export; date is 'YYYY-MM-DD HH:MM:SS'
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_chat_date ON messages (chat_id, date);
+CREATE INDEX IF NOT EXISTS messages_chat_user_date ON messages (chat_id, user_id, date);
+CREATE INDEX IF NOT EXISTS messages_user_date ON messages (user_id, date);
+
+-- day is 'YYYY-MM-DD'
+CREATE TABLE IF NOT EXISTS daily_counts (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    words INTEGER NOT NULL,
+    media INTEGER NOT NULL,
+    links INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_counts_day ON daily_counts (day);
+
+-- weekday 0 is Monday
+CREATE TABLE IF NOT EXISTS hourly_counts (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    weekday INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id, weekday, hour)
+) WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS monthly_counts AS
+SELECT c.key AS chat, u.name AS user, substr(d.day, 1, 7) AS month,
+       SUM(d.messages) AS messages, SUM(d.words) AS words, SUM(d.media) AS media, SUM(d.links) AS links
+FROM daily_counts d
+JOIN chats c ON c.id = d.chat_id
+JOIN users u ON u.id = d.user_id
+GROUP BY d.chat_id, d.user_id, month;
+"""
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class Store:
+    """A SQLite file of parsed chats, safe to share between threads"""
+
+    def __init__(self, path, timeout=60):
+        # several batch workers may write to the same file, each waits its turn
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def query(self, sql, params=()):
+        """Result of any SQL query as a DataFrame"""
+        with self._lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def chats(self):
+        return self.query('SELECT id, key, name, messages, first_date, last_date, added FROM chats ORDER BY id')
+
+    def add_chat(self, key, df, name=None):
+        """Stores a parsed chat under key, replacing the one stored under it before, returns its id"""
+        with diagnostics.stage('store.add', rows=len(df)):
+            codes, users = pd.factorize(np.asarray(df['user'], dtype=object), sort=False)
+            messages = df['message'].values
+            # the same counts MessageStats makes, but per day as well
+            index = chat_index.get(df)
+            words = np.diff(index.tokens.offsets)
+            media = messages == chat_index.MEDIA_MESSAGE
+            links = index.stats.row_links
+            days = df['date'].values.astype('datetime64[D]')
+            daily = pd.DataFrame({'user': codes, 'day': days, 'messages': 1, 'words': words,
+                                  'media': media.astype(np.int64), 'links': links})
+            daily = daily.groupby(['user', 'day'], sort=False).sum().reset_index()
+            hourly = pd.DataFrame({'user': codes, 'weekday': df['date'].dt.dayofweek.values,
+                                   'hour': df['date'].dt.hour.values})
+            hourly = hourly.groupby(['user', 'weekday', 'hour'], sort=False).size().reset_index()
+            fmt = preprocessor.format_of(df) or preprocessor.ANDROID
+            dates = df['date'].dt.strftime(DATE_FORMAT)
+
+            with self._lock, self.conn:
+                self._delete(key)
+                self.conn.executemany('INSERT OR IGNORE INTO users (name) VALUES (?)', ((u,) for u in users))
+                user_ids = np.array([self.conn.execute('SELECT id FROM users WHERE name = ?', (u,)).fetchone()[0]
+                                     for u in users], dtype=np.int64)
+                chat_id = self.conn.execute(
+                    'INSERT INTO chats (key, name, export_style, date_format, messages, first_date, last_date) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, name, fmt.style, fmt.date_format, len(df),
+                     dates.min() if len(df) else None, dates.max() if len(df) else None)).lastrowid
+                self.conn.executemany('INSERT INTO chat_users VALUES (?, ?, ?)',
+                                      ((chat_id, int(u), i) for i, u in enumerate(user_ids)))
+                self.conn.executemany(
+                    'INSERT INTO messages (chat_id, user_id, date, message) VALUES (?, ?, ?, ?)',
+                    zip([chat_id] * len(df), user_ids[codes].tolist(), dates.tolist(), messages.tolist()))
+                self.conn.executemany(
+                    'INSERT INTO daily_counts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    zip([chat_id] * len(daily), user_ids[daily['user'].values].tolist(),
+                        np.datetime_as_string(daily['day'].values.astype('datetime64[D]')).tolist(),
+                        *(daily[column].astype(np.int64).tolist()
+                          for column in ('messages', 'words', 'media', 'links'))))
+                self.conn.executemany(
+                    'INSERT INTO hourly_counts VALUES (?, ?, ?, ?, ?)',
+                    zip([chat_id] * len(hourly), user_ids[hourly['user'].values].tolist(),
+                        hourly['weekday'].tolist(), hourly['hour'].tolist(), hourly[0].tolist()))
+            return chat_id
+
+    def _delete(self, key):
+        row = self.conn.execute('SELECT id FROM chats WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        for table in ('messages', 'daily_counts', 'hourly_counts', 'chat_users'):
+            self.conn.execute('DELETE FROM %s WHERE chat_id = ?' % table, row)
+        self.conn.execute('DELETE FROM chats WHERE id = ?', row)
+
+    def remove_chat(self, key):
+        with self._lock, self.conn:
+            self._delete(key)
+
+    def chat(self, key):
+        """StoredChat of the chat stored under key, or None"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT id, export_style, date_format, messages FROM chats WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        chat_id, style, date_format, messages = row
+        return StoredChat(self, chat_id, preprocessor.export_format(style, date_format), messages)
+
+
+class StoredChat:
+    """A chat in a Store, which helper functions take in place of its DataFrame"""
+
+    def __init__(self, store, chat_id, fmt, messages):
+        self.store = store
+        self.chat_id = chat_id
+        self.fmt = fmt
+        self.messages = messages
+        chat_index.attach(self, StoredIndex(self))
+
+    def __len__(self):
+        return self.messages
+
+    def users(self):
+        """Names in order of first message"""
+        return self.store.query(
+            'SELECT u.name FROM chat_users cu JOIN users u ON u.id = cu.user_id '
+            'WHERE cu.chat_id = ? ORDER BY cu.position', (self.chat_id,))['name'].tolist()
+
+    def frame(self, selected_user='Overall'):
+        """The chat, or one user's messages, as preprocess() would have parsed it"""
+        sql = ('SELECT m.date, u.name AS user, m.message FROM messages m JOIN users u ON u.id = m.user_id '
+               'WHERE m.chat_id = ?')
+        params = (self.chat_id,)
+        if selected_user != 'Overall':
+            sql += ' AND m.user_id = (SELECT id FROM users WHERE name = ?)'
+            params += (selected_user,)
+        rows = self.store.query(sql + ' ORDER BY m.id', params)
+        return preprocessor.from_rows(pd.to_datetime(rows['date'], format=DATE_FORMAT),
+                                      rows['user'].values, rows['message'].values, self.fmt)
+
+
+class StoredIndex(chat_index.ChatIndex):
+    """ChatIndex of a StoredChat, built from its tables instead of a DataFrame"""
+
+    def __init__(self, chat):
+        super().__init__(chat)
+        self._frame = None
+        self._frame_lock = threading.Lock()
+
+    def frame(self):
+        # read once, by whichever of the text parts is needed first
+        with self._frame_lock:
+            if self._frame is None:
+                self._frame = self.df.frame()
+            return self._frame
+
+    def _user_rows(self, sql):
+        # rows of sql (first column the user's position) and the chat's users
+        chat = self.df
+        rows = chat.store.query(sql, (chat.chat_id,))
+        return rows, pd.Index(chat.users(), dtype=object)
+
+    @property
+    def stats(self):
+        def build():
+            rows, users = self._user_rows(
+                'SELECT cu.position, SUM(d.messages), SUM(d.words), SUM(d.media), SUM(d.links) '
+                'FROM daily_counts d JOIN chat_users cu ON cu.chat_id = d.chat_id AND cu.user_id = d.user_id '
+                'WHERE d.chat_id = ? GROUP BY cu.position')
+            counts = np.zeros((len(users), 4), dtype=np.int64)
+            # an empty result comes back as object columns, no good as indices
+            counts[rows.iloc[:, 0].values.astype(np.int64)] = rows.iloc[:, 1:].values
+            return chat_index.MessageStats.from_counts(users, counts)
+        return self._part('stats', build)
+
+    @property
+    def cube(self):
+        def build():
+            daily, users = self._user_rows(
+                'SELECT cu.position, d.day, d.messages FROM daily_counts d '
+                'JOIN chat_users cu ON cu.chat_id = d.chat_id AND cu.user_id = d.user_id WHERE d.chat_id = ?')
+            hourly, _ = self._user_rows(
+                'SELECT cu.position, h.weekday, h.hour, h.messages FROM hourly_counts h '
+                'JOIN chat_users cu ON cu.chat_id = h.chat_id AND cu.user_id = h.user_id WHERE h.chat_id = ?')
+            days = np.asarray(daily['day'], dtype='datetime64[D]')
+            first_day = days.min() if len(days) else np.datetime64('1970-01-01', 'D')
+            day_codes = (days - first_day).astype(np.int64)
+            counts = np.zeros((len(users), int(day_codes.max()) + 1 if len(days) else 0), dtype=np.int32)
+            counts[daily['position'].values.astype(np.int64), day_codes] = daily['messages'].values
+            hours = np.zeros((len(users), 7, 24), dtype=np.int32)
+            hours[hourly['position'].values.astype(np.int64), hourly['weekday'].values.astype(np.int64),
+                  hourly['hour'].values.astype(np.int64)] = hourly['messages'].values
+            return chat_index.ActivityCube.from_counts(users, first_day, counts, hours)
+        return self._part('cube', build)
+
+    @property
+    def tokens(self):
+        return self._part('tokens', lambda: chat_index.TokenIndex(self.frame()))
+
+    @property
+    def search(self):
+        tokens = self.tokens
+        return self._part('search', lambda: chat_index.SearchIndex(self.frame(), tokens))
+
+    @property
+    def emojis(self):
+        return self._part('emojis', lambda: chat_index.EmojiIndex(self.frame()))
+
+    @property
+    def sentiment(self):
+        return self._part('sentiment', lambda: chat_index.SentimentScores(self.frame()))
+
+    def messages(self, rows):
+        return self.frame().iloc[rows][['date', 'user', 'message']]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or len(argv) > 2:
+        print('usage: python store.py DATABASE [SQL]', file=sys.stderr)
+        return 2
+    with Store(argv[0]) as db:
+        result = db.query(argv[1]) if len(argv) == 2 else db.chats()
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(result.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())